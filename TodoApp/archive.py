@@ -0,0 +1,47 @@
+import asyncio
+import logging
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+import crud
+import database
+
+logger = logging.getLogger(__name__)
+
+# 冷热分离：完成超过 ARCHIVE_AFTER_DAYS 天的 todo 定期从 todos 搬到 todos_archive（配置见 database.py）。
+# todos 只留下未完成和最近完成的“热”数据，按 owner_id 的查询、索引和页缓存都更小；
+# 归档的 todo 通过 include_archived=true 仍然可以读到，POST /todo/{id}/restore 可以搬回来。
+# 每个分片各自归档，每批一个短事务，批与批之间会释放写锁，不会长时间挡住正常的写请求。
+
+
+def archive_shard(shard, completed_before: int, batch_size: int = database.ARCHIVE_BATCH_SIZE) -> int:
+    archived = 0
+    with shard.SessionLocal() as db:
+        while True:
+            count = database.busy_retry.run(
+                crud.archive_todos, db, completed_before, batch_size, rollback=db.rollback
+            )
+            archived += count
+            if count < batch_size:
+                return archived
+
+
+async def archive_completed(after_days: float = database.ARCHIVE_AFTER_DAYS,
+                            batch_size: int = database.ARCHIVE_BATCH_SIZE) -> int:
+    completed_before = int(time.time() - after_days * 86400)
+    archived = 0
+    for shard in database.todo_storage.shards:
+        archived += await run_in_threadpool(archive_shard, shard, completed_before, batch_size)
+    return archived
+
+
+async def periodic_archive(interval: int = database.ARCHIVE_INTERVAL):
+    while True:
+        try:
+            archived = await archive_completed()
+            if archived:
+                logger.info("Archived %d completed todos", archived)
+        except Exception:
+            logger.exception("Archiving completed todos failed")
+        await asyncio.sleep(interval)
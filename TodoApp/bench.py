@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+from models import Todos
+
+# 性能对比脚本：在 TodoApp 目录下执行 python bench.py <场景>。
+# 每个场景都在临时目录里新建数据库，不会碰到 todos.db。
+
+
+# 多个线程同时读写同一个 SQLite 文件，对比 default 和 production 两个引擎 profile
+def bench_sqlite_profile(args):
+    for profile_name in args.profiles:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = database.create_sqlite_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", profile_name)
+            models.Base.metadata.create_all(bind=engine)
+            SessionBench = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            counts = {"reads": 0, "writes": 0, "locked": 0}
+            lock = threading.Lock()
+            deadline = time.perf_counter() + args.seconds
+
+            def worker(worker_id: int):
+                is_writer = worker_id < args.writers
+                while time.perf_counter() < deadline:
+                    try:
+                        with SessionBench() as db:
+                            if is_writer:
+                                db.add(Todos(title="bench", description="bench", priority=3,
+                                             complete=False, owner_id=worker_id % 10))
+                                db.commit()
+                                key = "writes"
+                            else:
+                                db.scalars(select(Todos).where(Todos.owner_id == worker_id % 10).limit(50)).all()
+                                key = "reads"
+                    except OperationalError:
+                        key = "locked"
+                    with lock:
+                        counts[key] += 1
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.writers + args.readers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            engine.dispose()
+            print(f"{profile_name:>10}: {counts['writes'] / args.seconds:8.0f} writes/s  "
+                  f"{counts['reads'] / args.seconds:8.0f} reads/s  {counts['locked']} locked errors")
+
+
+# 列表接口的序列化开销：原来直接返回 ORM 对象（jsonable_encoder + json），
+# 对比声明 response_model 后的 Pydantic 序列化，以及再加上 FastJSONResponse（orjson）
+def bench_serialization(args):
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+    import responses
+    from routers.todos import TodoResponse
+
+    rows = [Todos(id=i, title=f"title {i}", description="learn fastAPI", priority=i % 5 + 1,
+                  complete=bool(i % 2), owner_id=i % 10) for i in range(args.rows)]
+    adapter = TypeAdapter(list[TodoResponse])
+
+    def python_mode():
+        return adapter.dump_python(adapter.validate_python(rows, from_attributes=True), mode="json")
+
+    scenarios = {
+        "jsonable_encoder + json": lambda: json.dumps(jsonable_encoder(rows)).encode(),
+        "response_model + json": lambda: json.dumps(python_mode()).encode(),
+        "response_model + FastJSONResponse": lambda: responses.FastJSONResponse(python_mode()).body,
+        "response_model (dump_json)": lambda: adapter.dump_json(adapter.validate_python(rows, from_attributes=True)),
+    }
+    for name, fn in scenarios.items():
+        fn()   # 预热
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            fn()
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(f"{name:>36}: {elapsed * 1000:8.1f} ms / {args.rows} rows")
+
+
+# 并发写入吞吐：每个操作各自提交 vs 分组提交（write_queue.GroupCommitWriter）
+def bench_group_commit(args):
+    from starlette.concurrency import run_in_threadpool
+    import crud
+    import write_queue
+    from routers.todos import TodoRequest
+
+    todo = TodoRequest(title="bench", description="bench", priority=3, complete=False)
+
+    async def run(mode: str, SessionBench) -> float:
+        writer = None
+        if mode == "group commit":
+            writer = write_queue.GroupCommitWriter(SessionBench, batch_size=args.batch_size,
+                                                   batch_delay_ms=args.batch_delay_ms)
+            writer.start()
+
+        def create_direct(owner_id: int):
+            with SessionBench() as db:
+                return crud.create_todo(db, todo, owner_id)
+
+        async def client(owner_id: int):
+            for _ in range(args.writes // args.concurrency):
+                if writer is not None:
+                    await writer.submit(crud.create_todo, todo, owner_id)
+                else:
+                    await run_in_threadpool(create_direct, owner_id)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        if writer is not None:
+            await writer.stop()
+        return (args.writes // args.concurrency) * args.concurrency / elapsed
+
+    for mode in ("commit per write", "group commit"):
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = database.create_sqlite_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", args.profile)
+            models.Base.metadata.create_all(bind=engine)
+            SessionBench = sessionmaker(autoflush=False, expire_on_commit=False, bind=engine)
+            writes_per_second = asyncio.run(run(mode, SessionBench))
+            engine.dispose()
+            print(f"{mode:>18}: {writes_per_second:8.0f} writes/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TodoApp benchmarks")
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+    profile_parser = subparsers.add_parser("sqlite-profile", help="对比 SQLite 引擎 profile 下的并发读写吞吐")
+    profile_parser.add_argument("--profiles", nargs="+", default=["default", "production"])
+    profile_parser.add_argument("--seconds", type=float, default=5)
+    profile_parser.add_argument("--writers", type=int, default=4)
+    profile_parser.add_argument("--readers", type=int, default=8)
+    profile_parser.set_defaults(func=bench_sqlite_profile)
+    serialization_parser = subparsers.add_parser("serialization", help="对比 ORM 列表的几种序列化方式")
+    serialization_parser.add_argument("--rows", type=int, default=10000)
+    serialization_parser.add_argument("--repeat", type=int, default=5)
+    serialization_parser.set_defaults(func=bench_serialization)
+    group_parser = subparsers.add_parser("group-commit", help="对比逐条提交和分组提交的写入吞吐")
+    group_parser.add_argument("--writes", type=int, default=2000)
+    group_parser.add_argument("--concurrency", type=int, default=50)
+    group_parser.add_argument("--batch-size", type=int, default=64)
+    group_parser.add_argument("--batch-delay-ms", type=float, default=5)
+    group_parser.add_argument("--profile", default="default")
+    group_parser.set_defaults(func=bench_group_commit)
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
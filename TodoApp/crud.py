@@ -1,50 +1,608 @@
+import asyncio
+import heapq
+import re
+import time
+from contextlib import ExitStack
+from itertools import islice
+from sqlalchemy import select, insert, update, delete, union_all, exists, literal, func, table, column, text, Boolean
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
-from models import Todos
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+import database
+import write_queue
+from models import Todos, TodosArchive, Users, TodoTombstones, TodoChangeSequence, TodoStats
 from pydantic import BaseModel
+from todo_cache import todo_list_cache
+from events import event_hub
+from user_cache import active_user_cache
+
+# 流式输出时，每次从数据库游标里取多少行（server-side yield_per）
+STREAM_CHUNK_SIZE = 500
+
+# 列表接口走的是 Core 查询：直接取 todos 表的列，结果是普通的行元组，
+# 不会为每一行创建 Todos ORM 对象，也不会进 Session 的 identity map，序列化完就可以直接丢掉。
+TODO_COLUMNS = tuple(Todos.__table__.columns)
+TODO_FIELDS = tuple(column.name for column in TODO_COLUMNS)
+
+# 只取部分列（fields= 参数）：列名已经由路由层按 TODO_FIELDS 校验过；不传时取全部列
+def todo_columns(fields: tuple[str, ...] | None = None) -> tuple:
+    if fields is None:
+        return TODO_COLUMNS
+    return tuple(Todos.__table__.c[name] for name in fields)
+
+# 写函数统一用 commit(db) 提交。分组提交模式下（write_queue.py），会话的 info 里带有 deferred_events，
+# 这时只 flush，真正的 COMMIT 由 writer 对整组操作执行一次。
+def commit(db: Session):
+    if "deferred_events" in db.info:
+        db.flush()
+    else:
+        db.commit()
+
+# 写操作提交之后调用：提前丢掉这个用户在本进程里缓存的列表（todo_cache.py；缓存是否有效以数据版本为准，见 get_owner_version），
+# 并把变化推送给这个用户在线的订阅者（events.py）。下面所有的写函数都一样。
+# 分组提交模式下要等整组提交成功之后才能通知，所以先记在会话上。
+def todos_changed(db: Session, owner_id: int, op: str, ids):
+    def notify():
+        todo_list_cache.invalidate(owner_id)
+        event_hub.publish(owner_id, {"op": op, "ids": list(ids)})
+    if "deferred_events" in db.info:
+        db.info["deferred_events"].append(notify)
+    else:
+        notify()
+
+# 新 todo 的 id 一律由 database.todo_ids 统一分配（原因见 database.py），不用 SQLite 的自增 id
+def new_todo_ids(count: int) -> list[int]:
+    return database.todo_ids.allocate(count)
 
 def create_todo(db: Session, todo_data: BaseModel, id: int):
     # 将 Pydantic 模型转换为 SQLAlchemy 模型
     new_todo = Todos(**todo_data.model_dump(), owner_id=id)
+    new_todo.id = new_todo_ids(1)[0]
     db.add(new_todo)
-    db.commit()
+    commit(db)
     db.refresh(new_todo)  # 刷新对象以获取数据库生成的值，如 id
+    todos_changed(db, id, "created", [new_todo.id])
     return new_todo
 
-def get_todo_by_id(db: Session, todo_id: int):
-    return db.query(Todos).filter(Todos.id == todo_id).first()
+# 键集分页（keyset / cursor pagination）：按 id 排序，用“上一页最后一个 id”作为游标。
+# 和 OFFSET 不同，不管翻到第几页，数据库都是直接从 id > after_id 的位置开始读，代价只和 limit 有关。
+# include_archived=True 时把归档表里的 todo 也按 id 合并进来（UNION ALL，两边都走 (owner_id, id) 索引），
+# 每一行多一个 archived 字段。
+def todos_page_stmt(owner_id: int | None = None, after_id: int | None = None, limit: int | None = None,
+                    fields: tuple[str, ...] | None = None, include_archived: bool = False):
+    def page(todo_table, *extra_columns):
+        stmt = select(*(todo_table.c[todo_column.name] for todo_column in todo_columns(fields)), *extra_columns)
+        if owner_id is not None:
+            stmt = stmt.where(todo_table.c.owner_id == owner_id)
+        if after_id is not None:
+            stmt = stmt.where(todo_table.c.id > after_id)
+        return stmt
+
+    if include_archived:
+        stmt = union_all(
+            page(Todos.__table__, literal(False, Boolean).label("archived")),
+            page(TodosArchive.__table__, literal(True, Boolean).label("archived")),
+        ).order_by("id")
+    else:
+        stmt = page(Todos.__table__).order_by(Todos.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+def get_todos_by_owner(db: Session, owner_id: int, after_id: int | None = None, limit: int | None = None,
+                       fields: tuple[str, ...] | None = None, include_archived: bool = False):
+    return db.execute(todos_page_stmt(owner_id, after_id, limit, fields, include_archived)).all()
+
+def todo_for_owner_stmt(todo_id: int, owner_id: int):
+    return select(Todos).where(Todos.id == todo_id).where(Todos.owner_id == owner_id)
+
+def get_todo_for_owner(db: Session, todo_id: int, owner_id: int):
+    return db.scalars(todo_for_owner_stmt(todo_id, owner_id)).first()
+
+# 只取部分列的单条查询；archived 不为 None 时查 todos_archive（或 todos）并带上 archived 字段
+def todo_row_stmt(todo_id: int, owner_id: int, fields: tuple[str, ...] | None = None, archived: bool | None = None):
+    if archived is None:
+        return select(*todo_columns(fields)).where(Todos.id == todo_id).where(Todos.owner_id == owner_id)
+    todo_table = TodosArchive.__table__ if archived else Todos.__table__
+    return (
+        select(*(todo_table.c[todo_column.name] for todo_column in todo_columns(fields)),
+               literal(archived, Boolean).label("archived"))
+        .where(todo_table.c.id == todo_id).where(todo_table.c.owner_id == owner_id)
+    )
+
+# 只取部分列的单条查询，返回行元组而不是 ORM 对象
+def get_todo_row_for_owner(db: Session, todo_id: int, owner_id: int, fields: tuple[str, ...] | None = None,
+                           include_archived: bool = False):
+    if not include_archived:
+        return db.execute(todo_row_stmt(todo_id, owner_id, fields)).first()
+    # 先找 todos，没有再找归档表
+    for archived in (False, True):
+        row = db.execute(todo_row_stmt(todo_id, owner_id, fields, archived)).first()
+        if row is not None:
+            return row
+    return None
+
+def get_all_todos(db: Session, after_id: int | None = None, limit: int | None = None,
+                  fields: tuple[str, ...] | None = None):
+    return db.execute(todos_page_stmt(None, after_id, limit, fields)).all()
+
+# 分片模式下管理员的列表：每个分片各自按 id 做同样的键集分页查询（都走主键），再按 id 归并取前 limit 条
+def _merge_shards_by_id(stmt, limit: int | None):
+    with ExitStack() as stack:
+        results = [
+            stack.enter_context(shard.ReadSessionLocal()).execute(stmt)
+            for shard in database.todo_storage.shards
+        ]
+        yield from islice(heapq.merge(*results, key=lambda row: row.id), limit)
+
+def get_all_todos_sharded(after_id: int | None = None, limit: int | None = None,
+                          fields: tuple[str, ...] | None = None):
+    return list(_merge_shards_by_id(todos_page_stmt(None, after_id, limit, fields), limit))
+
+# 行元组 -> 和 TodoResponse 字段顺序一致的字典（只取了部分列时只有这些字段），直接交给 JSON 编码
+def rows_to_dicts(rows) -> list[dict]:
+    if not rows:
+        return []
+    fields = rows[0]._fields
+    return [dict(zip(fields, row)) for row in rows]
+
+
+# 增量同步：返回 change_seq > since 的所有变化（修改过的 todo + 删除的墓碑），按序号排序。
+# 先读一次当前计数器的值作为上界，两次查询都只取不超过它的序号：
+# 就算两次查询之间有新的写入，也不会因为 next_since 跳过去而漏掉中间的变化。
+def changed_todos_stmt(owner_id: int, since: int, high: int, limit: int):
+    return (
+        select(*TODO_COLUMNS)
+        .where(Todos.owner_id == owner_id)
+        .where(Todos.change_seq > since).where(Todos.change_seq <= high)
+        .order_by(Todos.change_seq).limit(limit)
+    )
+
+def tombstones_stmt(owner_id: int, since: int, high: int, limit: int):
+    return (
+        select(TodoTombstones.id, TodoTombstones.change_seq)
+        .where(TodoTombstones.owner_id == owner_id)
+        .where(TodoTombstones.change_seq > since).where(TodoTombstones.change_seq <= high)
+        .order_by(TodoTombstones.change_seq).limit(limit)
+    )
+
+def get_changes(db: Session, owner_id: int, since: int, limit: int):
+    high = db.scalar(select(TodoChangeSequence.value).where(TodoChangeSequence.id == 1)) or 0
+    rows = db.execute(changed_todos_stmt(owner_id, since, high, limit + 1)).all()
+    tombstones = db.execute(tombstones_stmt(owner_id, since, high, limit + 1)).all()
+    changes = [{"seq": row.change_seq, "op": "upsert", "todo": todo} for row, todo in zip(rows, rows_to_dicts(rows))]
+    changes += [{"seq": tombstone.change_seq, "op": "delete", "id": tombstone.id} for tombstone in tombstones]
+    changes.sort(key=lambda change: change["seq"])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    # 没有更多变化时直接把游标推进到上界，客户端下次从这里开始
+    next_since = changes[-1]["seq"] if has_more else max(high, since)
+    return {"changes": changes, "next_since": next_since, "has_more": has_more}
+
+
+# 每个用户的数据版本：这个用户的 todos 和墓碑里最大的 change_seq。
+# 所有写操作（包括其它 worker、其它进程，比如 manage.py archive）都由触发器在同一个事务里推进它，删除和归档会写一条序号更大的墓碑，
+# 所以它只增不减，ETag 和列表缓存拿它当版本号，不依赖进程内的状态。两个子查询都走 (owner_id, change_seq) 索引，各读一个条目。
+def owner_version_stmt(owner_id: int):
+    todos_version = select(func.max(Todos.change_seq)).where(Todos.owner_id == owner_id).scalar_subquery()
+    tombstones_version = (
+        select(func.max(TodoTombstones.change_seq)).where(TodoTombstones.owner_id == owner_id).scalar_subquery()
+    )
+    return select(func.max(func.coalesce(todos_version, 0), func.coalesce(tombstones_version, 0)))
+
+def get_owner_version(db: Session, owner_id: int) -> int:
+    return db.scalar(owner_version_stmt(owner_id))
+
+
+# 接下来要做的 k 条：未完成的 todo 按 priority、id 排序取前 k 条。
+# (owner_id, complete, priority) 索引的每个条目末尾隐含 rowid（即 id），所以这个排序直接按索引顺序读出，
+# 不需要临时排序，读到第 k 条就停，代价和这个用户有多少 todo 无关。
+def next_todos_stmt(owner_id: int, k: int):
+    return (
+        select(*TODO_COLUMNS)
+        .where(Todos.owner_id == owner_id).where(Todos.complete == False)
+        .order_by(Todos.priority, Todos.id).limit(k)
+    )
+
+def get_next_todos(db: Session, owner_id: int, k: int):
+    return db.execute(next_todos_stmt(owner_id, k)).all()
+
+
+# 全文搜索（索引和触发器见 migrations.py）。用户输入不直接当作 FTS5 查询语法：
+# 只取出其中的词，每个词加引号当作普通短语，最后一个词按前缀匹配（边输入边搜）。
+# 只在标题和描述里找，并用 owner_id 列过滤限定在当前用户；bm25 打分时标题的权重高于描述。
+todos_fts = table("todos_fts", column("rowid"))
+SEARCH_WORD = re.compile(r"\w+")
+
+def fts_query(owner_id: int, q: str) -> str | None:
+    words = SEARCH_WORD.findall(q)
+    if not words:
+        return None
+    phrases = " ".join(f'"{word}"' for word in words) + "*"
+    return f'owner_id : "{owner_id}" AND {{title description}} : ({phrases})'
+
+def search_todos_stmt(owner_id: int, query: str, limit: int):
+    return (
+        select(*TODO_COLUMNS)
+        .join_from(Todos, todos_fts, Todos.id == todos_fts.c.rowid)
+        .where(text("todos_fts MATCH :query").bindparams(query=query)).where(Todos.owner_id == owner_id)
+        .order_by(text("bm25(todos_fts, 10.0, 5.0, 0.0)")).limit(limit)
+    )
+
+def search_todos(db: Session, owner_id: int, q: str, limit: int):
+    query = fts_query(owner_id, q)
+    if query is None:
+        return []
+    return db.execute(search_todos_stmt(owner_id, query, limit)).all()
+
+
+# 统计：直接读 todo_stats 里维护好的计数（触发器见 migrations.py），代价和 todo 的数量无关
+def summarize_stats(rows) -> dict:
+    stats = {"total": 0, "complete": 0, "incomplete": 0, "by_priority": {}}
+    for priority, complete, count in rows:
+        if not count:
+            continue
+        key = "complete" if complete else "incomplete"
+        bucket = stats["by_priority"].setdefault(str(priority), {"complete": 0, "incomplete": 0})
+        bucket[key] += count
+        stats[key] += count
+        stats["total"] += count
+    stats["by_priority"] = dict(sorted(stats["by_priority"].items(), key=lambda item: int(item[0])))
+    return stats
+
+def todo_stats_stmt(owner_id: int):
+    return select(TodoStats.priority, TodoStats.complete, TodoStats.count).where(TodoStats.owner_id == owner_id)
+
+def get_todo_stats(db: Session, owner_id: int):
+    return summarize_stats(db.execute(todo_stats_stmt(owner_id)).all())
+
+# 管理员的汇总：所有用户合计，分片模式下把每个分片的分组合计加起来
+def _all_stats_rows(db: Session):
+    return db.execute(
+        select(TodoStats.priority, TodoStats.complete, func.sum(TodoStats.count))
+        .where(TodoStats.count > 0)
+        .group_by(TodoStats.priority, TodoStats.complete)
+    ).all()
+
+# 只让数据库数出有 todo 的用户数，不把所有 owner_id 取回 Python。
+# 一个用户的 todo 只落在一个分片上，所以各分片的计数直接相加就是总数。
+def _count_owners_with_todos(db: Session) -> int:
+    return db.scalar(select(func.count(TodoStats.owner_id.distinct())).where(TodoStats.count > 0))
+
+def get_all_todo_stats(db: Session):
+    stats = summarize_stats(_all_stats_rows(db))
+    stats["owners"] = _count_owners_with_todos(db)
+    return stats
+
+def get_all_todo_stats_sharded():
+    rows, owners = [], 0
+    for shard in database.todo_storage.shards:
+        with shard.ReadSessionLocal() as db:
+            rows += _all_stats_rows(db)
+            owners += _count_owners_with_todos(db)
+    stats = summarize_stats(rows)
+    stats["owners"] = owners
+    return stats
+
+
+# 流式读取：不依赖请求的 db 会话（响应体是在路由函数返回之后才开始发送的），而是自己开一个只读会话，
+# 用 yield_per 让驱动按块从游标取数据，每次只在内存里保留一块。
+# 分片模式下管理员的流式列表（owner_id 为 None）要跨所有分片归并，统一在线程池里用同步会话完成。
+def _iter_todo_chunks_sync(stmt, shard, limit: int | None, chunk_size: int):
+    if shard is not None:
+        with shard.ReadSessionLocal() as db:
+            for chunk in db.execute(stmt).partitions():
+                yield rows_to_dicts(chunk)
+        return
+    rows = _merge_shards_by_id(stmt, limit)
+    while chunk := list(islice(rows, chunk_size)):
+        yield rows_to_dicts(chunk)
+
+async def iter_todo_chunks(owner_id: int | None = None, after_id: int | None = None,
+                           limit: int | None = None, chunk_size: int = STREAM_CHUNK_SIZE,
+                           fields: tuple[str, ...] | None = None, include_archived: bool = False):
+    stmt = todos_page_stmt(owner_id, after_id, limit, fields, include_archived).execution_options(yield_per=chunk_size)
+    storage = database.todo_storage
+    shard = storage.main if not storage.sharded else storage.shard_for_owner(owner_id) if owner_id is not None else None
+    if database.USE_ASYNC_DB and shard is not None:
+        async with database.shard_session(shard, read_only=True) as db:
+            result = await db.stream(stmt)
+            async for chunk in result.partitions():
+                yield rows_to_dicts(chunk)
+    else:
+        async for chunk in iterate_in_threadpool(_iter_todo_chunks_sync(stmt, shard, limit, chunk_size)):
+            yield chunk
 
-# 函数接收三个参数：
+# 函数接收四个参数：
     # 1. db: 数据库会话，我们通过它与数据库交谈。
     # 2. todo_id: 要更新的那条 Todo 记录的 ID。
     # 3. todo_data: 一个 Pydantic 模型实例，包含了用于更新的【新数据】。
-def update_todo(db: Session, todo_id: int, todo_data: BaseModel):
-    todo_model = get_todo_by_id(db, todo_id)
-    if todo_model is None:
-        #    策略: 这个 CRUD 函数选择不直接抛出 HTTP 异常。它只是简单地返回 None。这是一种很好的分层设计：
-        #          CRUD 层 (crud.py): 只负责数据库逻辑。它告诉调用者：“嘿，我没找到你要的东西。”
-        #          路由层 (main.py): 接收到这个 None 的返回值后，由它来决定如何向客户端响应。它会负责将这个 None 翻译成一个 HTTP 404 Not Found 错误。
-        return None 
-    
-    # 使用 Pydantic 模型的数据更新 SQLAlchemy 模型
+    # 4. owner_id: 当前用户的 ID，只能更新属于自己的 todo；为 None 时不检查（管理员）。
+# 以前的写法是 SELECT（按 id 查出 todo）-> 修改对象 -> COMMIT -> db.refresh 再 SELECT 一次，一次 PUT 要三条语句。
+# 现在用一条 UPDATE ... WHERE id = ? AND owner_id = ? RETURNING ...，查找、权限检查和取回新值一次完成。
+def update_todo_stmt(todo_id: int, values: dict, owner_id: int | None = None):
+    stmt = (
+        update(Todos)
+        .where(Todos.id == todo_id)
+        .values(**values)
+        .returning(*Todos.__table__.columns)
+        # 会话里没有需要同步的对象，跳过 ORM 的 synchronize_session 额外工作
+        .execution_options(synchronize_session=False)
+    )
+    if owner_id is not None:
+        stmt = stmt.where(Todos.owner_id == owner_id)
+    return stmt
+
+def update_todo(db: Session, todo_id: int, todo_data: BaseModel, owner_id: int | None = None):
     #todo_data.model_dump(): 将 Pydantic 模型 todo_data 转换为一个 Python 字典。例如：{'title': 'New Title', 'description': 'New Desc', ...}。
-    for key, value in todo_data.model_dump().items():
-        #todo_model.title = 'New Title'。
-        setattr(todo_model, key, value)
-        
-    db.add(todo_model)
-    db.commit()
-    db.refresh(todo_model)
-    return todo_model
+    updated_todo = db.execute(update_todo_stmt(todo_id, todo_data.model_dump(), owner_id)).first()
+    commit(db)
+    if updated_todo is not None:
+        todos_changed(db, updated_todo.owner_id, "updated", [updated_todo.id])
+    #    策略: 没有匹配的行（不存在，或者不属于这个用户）时返回 None，这个 CRUD 函数选择不直接抛出 HTTP 异常。这是一种很好的分层设计：
+    #          CRUD 层 (crud.py): 只负责数据库逻辑。它告诉调用者：“嘿，我没找到你要的东西。”
+    #          路由层 (routers/): 接收到这个 None 的返回值后，由它来决定如何向客户端响应。它会负责将这个 None 翻译成一个 HTTP 404 Not Found 错误。
+    return updated_todo
+
+
+# 同样用一条 DELETE ... RETURNING 完成，不再先查一遍
+def delete_todo_stmt(todo_id: int, owner_id: int | None = None):
+    stmt = (
+        delete(Todos)
+        .where(Todos.id == todo_id)
+        .returning(*Todos.__table__.columns)
+        .execution_options(synchronize_session=False)
+    )
+    if owner_id is not None:
+        stmt = stmt.where(Todos.owner_id == owner_id)
+    return stmt
+
+def delete_tode(db: Session , todo_id: int, owner_id: int | None = None):
+    deleted_todo = db.execute(delete_todo_stmt(todo_id, owner_id)).first()
+    commit(db)
+    if deleted_todo is not None:
+        todos_changed(db, deleted_todo.owner_id, "deleted", [deleted_todo.id])
+    return deleted_todo
+
 
+# ==========================
+# 归档
+# ==========================
+# 把一批完成时间早于 completed_before（unix 秒）的 todo 搬进 todos_archive，返回搬了多少条。
+# 对客户端来说归档等于从列表里消失：删除触发器照常写墓碑，增量同步会收到 delete；统计计数不变（见 migrations.py）。
+def archive_todos(db: Session, completed_before: int, batch_size: int) -> int:
+    ids = db.scalars(
+        select(Todos.id).where(Todos.completed_at <= completed_before).where(Todos.complete == True)
+        .order_by(Todos.completed_at).limit(batch_size)
+    ).all()
+    if not ids:
+        return 0
+    db.execute(insert(TodosArchive).from_select(
+        [*TODO_FIELDS, "archived_at"],
+        select(*TODO_COLUMNS, literal(int(time.time()))).where(Todos.id.in_(ids)),
+    ))
+    archived = db.execute(
+        delete(Todos).where(Todos.id.in_(ids)).returning(Todos.owner_id, Todos.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    commit(db)
+    archived_by_owner = {}
+    for owner_id, todo_id in archived:
+        archived_by_owner.setdefault(owner_id, []).append(todo_id)
+    for owner_id, todo_ids in archived_by_owner.items():
+        todos_changed(db, owner_id, "archived", todo_ids)
+    return len(archived)
 
-def delete_tode(db: Session , todo_id: int ):
-    todo_to_delete = get_todo_by_id(db, todo_id)
-    if todo_to_delete is None:
+# 恢复：从归档表搬回 todos，id 不变。completed_at 清空后由触发器重新记为现在，刚恢复的 todo 不会马上又被归档。
+# 找不到（或者 todos 里已经有同 id 的行）时返回 None。
+def restore_todo(db: Session, todo_id: int, owner_id: int):
+    restored_fields = [name for name in TODO_FIELDS if name != "completed_at"]
+    restored = db.execute(insert(Todos).from_select(
+        restored_fields,
+        select(*(TodosArchive.__table__.c[name] for name in restored_fields))
+        .where(TodosArchive.id == todo_id).where(TodosArchive.owner_id == owner_id)
+        .where(~exists().where(Todos.id == todo_id)),
+    )).rowcount
+    if not restored:
         return None
-    
-    db.delete(todo_to_delete)
+    db.execute(delete(TodosArchive).where(TodosArchive.id == todo_id))
+    commit(db)
+    todos_changed(db, owner_id, "restored", [todo_id])
+    return db.execute(select(*TODO_COLUMNS).where(Todos.id == todo_id)).first()
+
+
+# ==========================
+# 批量操作
+# ==========================
+# 同步客户端一次会推上百条改动。逐条调用上面的函数意味着上百次 HTTP 往返和上百次 commit（每次都是一次 fsync）。
+# 下面的函数把整批数据用批量语句写入，并且只在最后 commit 一次：要么全部成功，要么全部回滚。
+# 每个函数都返回逐条的结果，顺序和传入的列表一致。
+
+def create_todos(db: Session, todos_data: list[BaseModel], id: int):
+    rows = [{**todo_data.model_dump(), "owner_id": id} for todo_data in todos_data]
+    for row, new_id in zip(rows, new_todo_ids(len(rows))):
+        row["id"] = new_id
+    # 一条 INSERT ... RETURNING（executemany），按参数顺序返回生成的 id
+    new_ids = db.scalars(
+        insert(Todos).returning(Todos.id, sort_by_parameter_order=True), rows
+    ).all()
+    commit(db)
+    todos_changed(db, id, "created", new_ids)
+    return [{"id": new_id, "status": "created"} for new_id in new_ids]
+
+def update_todos(db: Session, todos_data: list[BaseModel], owner_id: int):
+    ids = [todo_data.id for todo_data in todos_data]
+    # 只允许更新属于当前用户的 todo
+    owned_ids = set(db.scalars(
+        select(Todos.id).where(Todos.id.in_(ids)).where(Todos.owner_id == owner_id)
+    ).all())
+    rows = [todo_data.model_dump() for todo_data in todos_data if todo_data.id in owned_ids]
+    if rows:
+        # ORM 批量 UPDATE（按主键匹配），一次 executemany
+        db.execute(update(Todos), rows)
+    commit(db)
+    if rows:
+        todos_changed(db, owner_id, "updated", [row["id"] for row in rows])
+    return [{"id": todo_id, "status": "updated" if todo_id in owned_ids else "not_found"} for todo_id in ids]
+
+def delete_todos(db: Session, todo_ids: list[int], owner_id: int):
+    deleted_ids = set(db.scalars(
+        delete(Todos).where(Todos.id.in_(todo_ids)).where(Todos.owner_id == owner_id).returning(Todos.id)
+    ).all())
+    commit(db)
+    if deleted_ids:
+        todos_changed(db, owner_id, "deleted", sorted(deleted_ids))
+    return [{"id": todo_id, "status": "deleted" if todo_id in deleted_ids else "not_found"} for todo_id in todo_ids]
+
+
+def get_user_by_username(db: Session, username: str):
+    return db.query(Users).filter(Users.username == username).first()
+
+def get_user_by_username_or_email(db: Session, username: str, email: str):
+    return db.query(Users).filter((Users.username == username) | (Users.email == email)).first()
+
+def create_user(db: Session, user_data: dict, hashed_password: str):
+    new_user = Users(**user_data, hashed_password=hashed_password)
+    db.add(new_user)
     db.commit()
-    print(todo_to_delete)
-    return todo_to_delete
-    
+    db.refresh(new_user)
+    # SQLite 可能复用被删用户的 id，缓存里“查无此人”的结果要作废
+    active_user_cache.invalidate(new_user.id)
+    return new_user
+
+# 鉴权用的用户状态：只取 get_current_user 需要的几列
+USER_AUTH_COLUMNS = (Users.id, Users.username, Users.role, Users.is_active)
+
+def get_user_for_auth(db: Session, user_id: int):
+    return db.execute(select(*USER_AUTH_COLUMNS).where(Users.id == user_id)).first()
+
+# 修改用户的角色 / 启用状态，提交后让本进程的用户缓存失效（user_cache.py）。找不到用户时返回 None。
+def update_user(db: Session, user_id: int, values: dict):
+    updated_user = db.execute(
+        update(Users).where(Users.id == user_id).values(**values).returning(*USER_AUTH_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).first()
+    db.commit()
+    active_user_cache.invalidate(user_id)
+    return updated_user
+
+
+# ==========================
+# 异步版本
+# ==========================
+# 路由都是 async def，不能在里面直接跑同步的数据库调用，否则会阻塞事件循环。
+# - AsyncSession（TODO_ASYNC_DB=1）：通过 run_sync 执行上面的同步函数，底层驱动是 aiosqlite，真正的 I/O 都是 await 出去的；
+# - 同步 Session：把函数丢进线程池执行，事件循环同样不会被卡住。
+# 这样业务逻辑只写一份，两种模式行为完全一致。
+async def run_db(db: Session | AsyncSession, fn, *args, **kwargs):
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+# todo 的写操作：打开了分组提交（TODO_WRITE_BATCHING=1）时交给 write_queue 里唯一的 writer，否则直接执行。
+# 遇到其它进程正持有写锁（SQLITE_BUSY / database is locked）时，回滚后按 database.busy_retry 的退避策略重试。
+async def run_write(db: Session | AsyncSession, fn, *args):
+    if write_queue.group_writer.running:
+        # 交给 writer 时带上这个会话的 engine，分片模式下 writer 才知道写到哪个文件
+        bind = database.todo_storage.sync_engine_for(db.bind)
+        return await write_queue.group_writer.submit(fn, *args, bind=bind)
+    attempt = 0
+    while True:
+        try:
+            result = await run_db(db, fn, *args)
+        except OperationalError as exc:
+            delay = database.busy_retry.next_delay(exc, attempt)
+            if delay is None:
+                raise
+            await run_db(db, Session.rollback)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        if attempt:
+            database.busy_retry.record_recovered()
+        return result
+
+async def create_todo_async(db, todo_data: BaseModel, id: int):
+    return await run_write(db, create_todo, todo_data, id)
+
+async def get_todos_by_owner_async(db, owner_id: int, after_id: int | None = None, limit: int | None = None,
+                                   fields: tuple[str, ...] | None = None, include_archived: bool = False):
+    return await run_db(db, get_todos_by_owner, owner_id, after_id, limit, fields, include_archived)
+
+async def get_todo_for_owner_async(db, todo_id: int, owner_id: int):
+    return await run_db(db, get_todo_for_owner, todo_id, owner_id)
+
+async def get_todo_row_for_owner_async(db, todo_id: int, owner_id: int, fields: tuple[str, ...] | None = None,
+                                       include_archived: bool = False):
+    return await run_db(db, get_todo_row_for_owner, todo_id, owner_id, fields, include_archived)
+
+async def get_owner_version_async(db, owner_id: int) -> int:
+    return await run_db(db, get_owner_version, owner_id)
+
+async def get_changes_async(db, owner_id: int, since: int, limit: int):
+    return await run_db(db, get_changes, owner_id, since, limit)
+
+async def get_next_todos_async(db, owner_id: int, k: int):
+    return await run_db(db, get_next_todos, owner_id, k)
+
+async def search_todos_async(db, owner_id: int, q: str, limit: int):
+    return await run_db(db, search_todos, owner_id, q, limit)
+
+async def get_todo_stats_async(db, owner_id: int):
+    return await run_db(db, get_todo_stats, owner_id)
+
+async def get_all_todo_stats_async(db):
+    if database.todo_storage.sharded:
+        return await run_in_threadpool(get_all_todo_stats_sharded)
+    return await run_db(db, get_all_todo_stats)
+
+async def get_all_todos_async(db, after_id: int | None = None, limit: int | None = None,
+                              fields: tuple[str, ...] | None = None):
+    if database.todo_storage.sharded:
+        return await run_in_threadpool(get_all_todos_sharded, after_id, limit, fields)
+    return await run_db(db, get_all_todos, after_id, limit, fields)
+
+async def update_todo_async(db, todo_id: int, todo_data: BaseModel, owner_id: int | None = None):
+    return await run_write(db, update_todo, todo_id, todo_data, owner_id)
+
+async def delete_tode_async(db, todo_id: int, owner_id: int | None = None):
+    return await run_write(db, delete_tode, todo_id, owner_id)
+
+# 管理员按 id 删除：不知道 todo 属于谁，分片模式下依次到每个分片上尝试（id 全局唯一，删到就停）
+async def admin_delete_todo_async(db, todo_id: int):
+    if not database.todo_storage.sharded:
+        return await delete_tode_async(db, todo_id)
+    for shard in database.todo_storage.shards:
+        async with database.shard_session(shard) as shard_db:
+            deleted_todo = await delete_tode_async(shard_db, todo_id)
+        if deleted_todo is not None:
+            return deleted_todo
+    return None
+
+async def restore_todo_async(db, todo_id: int, owner_id: int):
+    return await run_write(db, restore_todo, todo_id, owner_id)
+
+async def create_todos_async(db, todos_data: list[BaseModel], id: int):
+    return await run_write(db, create_todos, todos_data, id)
+
+async def update_todos_async(db, todos_data: list[BaseModel], owner_id: int):
+    return await run_write(db, update_todos, todos_data, owner_id)
+
+async def delete_todos_async(db, todo_ids: list[int], owner_id: int):
+    return await run_write(db, delete_todos, todo_ids, owner_id)
+
+async def get_user_by_username_async(db, username: str):
+    return await run_db(db, get_user_by_username, username)
+
+async def get_user_by_username_or_email_async(db, username: str, email: str):
+    return await run_db(db, get_user_by_username_or_email, username, email)
+
+async def create_user_async(db, user_data: dict, hashed_password: str):
+    return await run_db(db, create_user, user_data, hashed_password)
+
+async def get_user_for_auth_async(db, user_id: int):
+    return await run_db(db, get_user_for_auth, user_id)
 
+async def update_user_async(db, user_id: int, values: dict):
+    return await run_db(db, update_user, user_id, values)
@@ -1,17 +1,458 @@
-from sqlalchemy import create_engine, Column, Integer, String
+import asyncio
+import glob
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from sqlalchemy import create_engine, event, text, Column, Integer, String
+from sqlalchemy.exc import OperationalError
 #与数据库的所有交互都是通过 Session (会话)进行的。可以把 Session 看作是与数据库进行对话的临时工作区。
 #数据模型是数据库中表的 Python 表示。我们使用 SQLAlchemy 的 Declarative Base 来定义模型。
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# SQLite 引擎配置（profile），通过环境变量 TODO_DB_PROFILE 选择：
+# - default：和原来一样，只设置 check_same_thread=False（回滚日志模式、默认缓存、读写互相阻塞）。
+# - production：WAL 日志（读不阻塞写，写不阻塞读）、synchronous=NORMAL（WAL 下仍然安全，只是断电时可能丢最后几个事务）、
+#   更大的页缓存和 mmap、busy_timeout（遇到写锁先等待，而不是立刻报 "database is locked"），以及更大的连接池。
+# 每个 PRAGMA 都可以用 TODO_SQLITE_<PRAGMA 名大写> 覆盖，例如 TODO_SQLITE_CACHE_SIZE=-200000。
+DB_PROFILE = os.getenv("TODO_DB_PROFILE", "default")
+
+SQLITE_PROFILES = {
+    "default": {
+        "pragmas": {},
+        "pool_size": None,
+        "max_overflow": None,
+    },
+    "production": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,            # 毫秒
+            "cache_size": -64000,            # 负数表示 KiB，即 64MB
+            "mmap_size": 268435456,          # 256MB
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 10,
+        "max_overflow": 20,
+    },
+}
+
+
+def sqlite_profile(name: str = DB_PROFILE) -> dict:
+    profile = SQLITE_PROFILES[name]
+    pragmas = {
+        pragma: os.getenv(f"TODO_SQLITE_{pragma.upper()}", value)
+        for pragma, value in profile["pragmas"].items()
+    }
+    pool_size = os.getenv("TODO_DB_POOL_SIZE", profile["pool_size"])
+    max_overflow = os.getenv("TODO_DB_MAX_OVERFLOW", profile["max_overflow"])
+    return {
+        "pragmas": pragmas,
+        "pool_size": int(pool_size) if pool_size is not None else None,
+        "max_overflow": int(max_overflow) if max_overflow is not None else None,
+    }
+
+
+# PRAGMA 大多是“连接级别”的设置，所以要在连接池每创建一个新连接时执行一次
+def _set_sqlite_pragmas(pragmas: dict):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+    return on_connect
+
+
+def _pool_kwargs(profile: dict) -> dict:
+    kwargs = {}
+    if profile["pool_size"] is not None:
+        kwargs["pool_size"] = profile["pool_size"]
+    if profile["max_overflow"] is not None:
+        kwargs["max_overflow"] = profile["max_overflow"]
+    return kwargs
+
+
+# 只读连接：journal_mode 是数据库级别的设置，只能由写连接修改；再加上 query_only，任何写语句都会直接报错。
+def _connection_pragmas(profile: dict, read_only: bool) -> dict:
+    if not read_only:
+        return profile["pragmas"]
+    pragmas = {pragma: value for pragma, value in profile["pragmas"].items() if pragma != "journal_mode"}
+    pragmas["query_only"] = "ON"
+    return pragmas
+
+
+def create_sqlite_engine(url: str, profile_name: str = DB_PROFILE, read_only: bool = False):
+    profile = sqlite_profile(profile_name)
+    pragmas = _connection_pragmas(profile, read_only)
+    #connect_args` 是一个特殊配置，专门用于 SQLite，以解决多线程访问的问题，这在像 FastAPI 这样的 Web 应用中是必需的。
+    sqlite_engine = create_engine(url, connect_args={"check_same_thread": False}, **_pool_kwargs(profile))
+    if pragmas:
+        event.listen(sqlite_engine, "connect", _set_sqlite_pragmas(pragmas))
+    return sqlite_engine
+
+
+def create_async_sqlite_engine(url: str, profile_name: str = DB_PROFILE, read_only: bool = False):
+    profile = sqlite_profile(profile_name)
+    pragmas = _connection_pragmas(profile, read_only)
+    sqlite_engine = create_async_engine(url, **_pool_kwargs(profile))
+    if pragmas:
+        event.listen(sqlite_engine.sync_engine, "connect", _set_sqlite_pragmas(pragmas))
+    return sqlite_engine
+
 
 # 创建数据库引擎
 DATABASE_URL = "sqlite:///./todos.db"
-#connect_args` 是一个特殊配置，专门用于 SQLite，以解决多线程访问的问题，这在像 FastAPI 这样的 Web 应用中是必需的。
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_sqlite_engine(DATABASE_URL)
 
 # autocommit=False 和 autoflush=False 是推荐的设置，让你能更好地控制事务。
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+# 异步数据库配置：设置环境变量 TODO_ASYNC_DB=1 即可切换到异步引擎。
+# 路由都是 async def，如果在里面直接调用同步的 db.query()/db.commit()，一次慢写入就会卡住整个事件循环，
+# 同一个 worker 上的其它请求全部跟着排队。aiosqlite 把 SQLite 调用放在自己的线程里，事件循环只负责 await。
+USE_ASYNC_DB = os.getenv("TODO_ASYNC_DB", "0") == "1"
+ASYNC_DATABASE_URL = os.getenv("TODO_ASYNC_DATABASE_URL", "sqlite+aiosqlite:///./todos.db")
+
+async_engine = create_async_sqlite_engine(ASYNC_DATABASE_URL) if USE_ASYNC_DB else None
+
+# expire_on_commit=False：提交后对象的属性仍然可用，否则在响应序列化时会触发隐式的（同步）懒加载。
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+) if USE_ASYNC_DB else None
+
+
+def get_sync_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# 路由统一依赖 get_db，由配置决定拿到的是同步 Session 还是 AsyncSession。
+# crud.py 中的 *_async 函数两种会话都能接收。
+get_db = get_async_db if USE_ASYNC_DB else get_sync_db
+
+
+# 读写分离：GET 路由使用单独的只读连接池（mode=ro 打开文件 + PRAGMA query_only）。
+# 在 WAL 模式下读连接永远不会去拿写锁，大量的列表请求就不会和写请求抢连接、抢锁。
+# 设置 TODO_READ_POOL=0 可以关闭，此时 get_read_db 和 get_db 完全一样。
+USE_READ_POOL = os.getenv("TODO_READ_POOL", "1") == "1"
+READ_DATABASE_URL = os.getenv("TODO_READ_DATABASE_URL", "sqlite:///file:./todos.db?mode=ro&uri=true")
+ASYNC_READ_DATABASE_URL = os.getenv(
+    "TODO_ASYNC_READ_DATABASE_URL", "sqlite+aiosqlite:///file:./todos.db?mode=ro&uri=true"
+)
+
+if USE_READ_POOL:
+    read_engine = create_sqlite_engine(READ_DATABASE_URL, read_only=True)
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+else:
+    read_engine, ReadSessionLocal = engine, SessionLocal
+
+if USE_ASYNC_DB and USE_READ_POOL:
+    async_read_engine = create_async_sqlite_engine(ASYNC_READ_DATABASE_URL, read_only=True)
+    AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, autoflush=False, expire_on_commit=False)
+else:
+    async_read_engine, AsyncReadSessionLocal = async_engine, AsyncSessionLocal
+
+
+def get_sync_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+get_read_db = get_async_read_db if USE_ASYNC_DB else get_sync_read_db
+
+
+# 多进程写入：用 gunicorn/uvicorn 开多个 worker 时，它们共享同一个 todos.db，但 SQLite 同一时刻只允许一个写事务。
+# busy_timeout 能覆盖大部分等待，但有些情况 SQLite 会立刻返回 SQLITE_BUSY（例如 WAL 下先读后写的事务，
+# 读快照已经过期，升级成写事务时无法等待），这时只能回滚整个事务再重来。
+# BusyRetryPolicy 负责判断是不是“锁冲突”类错误、计算带抖动的指数退避时间，并记录指标。
+# crud.run_write 和分组提交的 writer 都通过它重试写操作。
+class BusyRetryPolicy:
+    def __init__(self, max_attempts: int = 8, base_delay: float = 0.005, max_delay: float = 0.5):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.busy_errors = 0
+        self.recovered = 0
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_busy(exc: Exception) -> bool:
+        orig = getattr(exc, "orig", exc)
+        if not isinstance(orig, sqlite3.OperationalError):
+            return False
+        message = str(orig).lower()
+        return "locked" in message or "busy" in message
+
+    def next_delay(self, exc: Exception, attempt: int) -> float | None:
+        """第 attempt 次（从 0 开始）失败后应该等多久再重试；返回 None 表示不要重试，直接抛出。"""
+        if not self.is_busy(exc):
+            return None
+        with self._lock:
+            self.busy_errors += 1
+            if attempt + 1 >= self.max_attempts:
+                self.exhausted += 1
+                return None
+        # full jitter：在 [0, min(max_delay, base * 2^attempt)] 之间随机，避免多个 worker 同时醒来再次撞车
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def record_recovered(self):
+        with self._lock:
+            self.recovered += 1
+
+    # 同步版本，只能在线程池 / 独立线程里用（会 time.sleep）
+    def run(self, fn, *args, rollback=None):
+        attempt = 0
+        while True:
+            try:
+                result = fn(*args)
+            except OperationalError as exc:
+                delay = self.next_delay(exc, attempt)
+                if delay is None:
+                    raise
+                if rollback is not None:
+                    rollback()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if attempt:
+                self.record_recovered()
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "busy_errors": self.busy_errors,
+            "recovered": self.recovered,
+            "exhausted": self.exhausted,
+            "max_attempts": self.max_attempts,
+        }
+
+
+busy_retry = BusyRetryPolicy(
+    max_attempts=int(os.getenv("TODO_BUSY_RETRY_ATTEMPTS", "8")),
+    base_delay=float(os.getenv("TODO_BUSY_RETRY_BASE_MS", "5")) / 1000,
+    max_delay=float(os.getenv("TODO_BUSY_RETRY_MAX_MS", "500")) / 1000,
+)
+
+
+# ==========================
+# todo 的存储位置（可选分片）
+# ==========================
+# 默认所有用户的 todos 都在 todos.db 这一个文件里，一个文件的写锁就是所有人写吞吐的上限。
+# 设置 TODO_SHARDS=N（N > 0）后，todos 相关的表按 owner_id % N 分散到 TODO_SHARD_DIR 下的 N 个 SQLite 文件，
+# 每个文件有自己的写锁；users 表仍然在 todos.db 里。
+# 路由通过 owner_session(owner_id) 拿到对应分片的会话，crud.py 的函数不需要关心数据在哪个文件里。
+# 已有的数据用 python manage.py rebalance-shards 迁移（分片数量变化后也用它重新分布）。
+SHARD_COUNT = int(os.getenv("TODO_SHARDS", "0"))
+SHARD_DIR = os.getenv("TODO_SHARD_DIR", "./shards")
+
+
+class TodoShard:
+    """一个存放 todos 的数据库文件，以及它的读写/只读、同步/异步会话工厂"""
+
+    def __init__(self, name: str, engine, SessionLocal, ReadSessionLocal,
+                 AsyncSessionLocal=None, AsyncReadSessionLocal=None):
+        self.name = name
+        self.engine = engine
+        self.SessionLocal = SessionLocal
+        self.ReadSessionLocal = ReadSessionLocal
+        self.AsyncSessionLocal = AsyncSessionLocal
+        self.AsyncReadSessionLocal = AsyncReadSessionLocal
+
+    @classmethod
+    def open(cls, name: str, path: str):
+        shard_engine = create_sqlite_engine(f"sqlite:///{path}")
+        shard_read_engine = (
+            create_sqlite_engine(f"sqlite:///file:{path}?mode=ro&uri=true", read_only=True)
+            if USE_READ_POOL else shard_engine
+        )
+        async_factories = {}
+        if USE_ASYNC_DB:
+            shard_async_engine = create_async_sqlite_engine(f"sqlite+aiosqlite:///{path}")
+            shard_async_read_engine = (
+                create_async_sqlite_engine(f"sqlite+aiosqlite:///file:{path}?mode=ro&uri=true", read_only=True)
+                if USE_READ_POOL else shard_async_engine
+            )
+            async_factories = {
+                "AsyncSessionLocal": async_sessionmaker(bind=shard_async_engine, autoflush=False, expire_on_commit=False),
+                "AsyncReadSessionLocal": async_sessionmaker(
+                    bind=shard_async_read_engine, autoflush=False, expire_on_commit=False
+                ),
+            }
+        return cls(
+            name,
+            shard_engine,
+            sessionmaker(autocommit=False, autoflush=False, bind=shard_engine),
+            sessionmaker(autocommit=False, autoflush=False, bind=shard_read_engine),
+            **async_factories,
+        )
+
+    def session_factory(self, read_only: bool = False):
+        if USE_ASYNC_DB:
+            return self.AsyncReadSessionLocal if read_only else self.AsyncSessionLocal
+        return self.ReadSessionLocal if read_only else self.SessionLocal
+
+
+def shard_path(index: int, directory: str = SHARD_DIR) -> str:
+    return os.path.join(directory, f"todos_shard_{index}.db")
+
+
+def existing_shard_paths(directory: str = SHARD_DIR) -> list[str]:
+    return sorted(glob.glob(os.path.join(directory, "todos_shard_*.db")))
+
+
+class TodoStorage:
+    def __init__(self, shard_count: int = SHARD_COUNT, directory: str = SHARD_DIR):
+        self.main = TodoShard("main", engine, SessionLocal, ReadSessionLocal, AsyncSessionLocal, AsyncReadSessionLocal)
+        self.sharded = shard_count > 0
+        if self.sharded:
+            os.makedirs(directory, exist_ok=True)
+            self.shards = [TodoShard.open(f"shard_{index}", shard_path(index, directory)) for index in range(shard_count)]
+        else:
+            self.shards = [self.main]
+
+    def shard_for_owner(self, owner_id: int) -> TodoShard:
+        return self.shards[owner_id % len(self.shards)]
+
+    # 会话的 bind（同步或异步 engine）对应的同步 engine：分组提交的 writer 在线程里用它写入
+    def sync_engine_for(self, bind):
+        for shard in [self.main, *self.shards]:
+            if bind is shard.engine or (shard.AsyncSessionLocal is not None and bind is shard.AsyncSessionLocal.kw["bind"]):
+                return shard.engine
+        return engine
+
+
+todo_storage = TodoStorage()
+
+
+# 打开某个分片的会话（同步/异步由 TODO_ASYNC_DB 决定），用法：async with shard_session(shard) as db: ...
+@asynccontextmanager
+async def shard_session(shard: TodoShard, read_only: bool = False):
+    factory = shard.session_factory(read_only)
+    if USE_ASYNC_DB:
+        async with factory() as db:
+            yield db
+    else:
+        db = factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+def owner_session(owner_id: int, read_only: bool = False):
+    return shard_session(todo_storage.shard_for_owner(owner_id), read_only)
+
+
+# 分片之后每个文件的自增 id 会重复，所以 todo 的 id 由 todos.db 里的一个计数器统一分配。
+# 不分片也要用它：SQLite 的自增 id 是“当前最大 id + 1”，最大的那几条被归档（包括服务没开 TODO_ARCHIVE_AFTER_DAYS、
+# 由 manage.py archive 在进程外归档）后 id 会被重新用掉，恢复时就冲突了。
+# 用 hi/lo 方式：每次从数据库领一整块（TODO_ID_BLOCK_SIZE 个）id，在进程内分发，用完再领，绝大多数插入不需要访问 todos.db。
+TODO_ID_BLOCK_SIZE = int(os.getenv("TODO_ID_BLOCK_SIZE", "1000"))
+# 已经用过的最大 id，包括归档表
+MAX_TODO_ID_SQL = "SELECT coalesce(max(id), 0) FROM (SELECT max(id) AS id FROM todos UNION ALL SELECT max(id) FROM todos_archive)"
+
+
+class TodoIdAllocator:
+    def __init__(self, storage: TodoStorage, block_size: int = TODO_ID_BLOCK_SIZE):
+        self.storage = storage
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def _max_existing_id(self) -> int:
+        max_id = 0
+        for shard in {id(shard): shard for shard in [self.storage.main, *self.storage.shards]}.values():
+            with shard.engine.connect() as conn:
+                max_id = max(max_id, conn.execute(text(MAX_TODO_ID_SQL)).scalar())
+        return max_id
+
+    def _take_block(self) -> int:
+        with engine.begin() as conn:
+            block = conn.execute(text("SELECT next_block FROM todo_id_allocator WHERE id = 1")).scalar()
+            if block is None:
+                # 第一次使用：从现有数据的最大 id 之后开始，兼容从 todos.db 迁移过来的旧数据
+                conn.execute(
+                    text("INSERT OR IGNORE INTO todo_id_allocator (id, next_block) VALUES (1, :block)"),
+                    {"block": self._max_existing_id() // self.block_size + 1},
+                )
+            return conn.execute(
+                text("UPDATE todo_id_allocator SET next_block = next_block + 1 WHERE id = 1 RETURNING next_block - 1")
+            ).scalar()
+
+    def allocate(self, count: int = 1) -> list[int]:
+        with self._lock:
+            ids = []
+            while len(ids) < count:
+                if self._next >= self._end:
+                    block = busy_retry.run(self._take_block)
+                    self._next, self._end = block * self.block_size, (block + 1) * self.block_size
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+            return ids
+
+
+todo_ids = TodoIdAllocator(todo_storage)
+
+
+# 归档：完成超过 TODO_ARCHIVE_AFTER_DAYS 天的 todo 由后台任务（archive.py）搬到 todos_archive，0 表示关闭。
+# 每批最多 TODO_ARCHIVE_BATCH_SIZE 条、一个短事务，不会长时间占住写锁。
+ARCHIVE_AFTER_DAYS = float(os.getenv("TODO_ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_INTERVAL = int(os.getenv("TODO_ARCHIVE_INTERVAL", "3600"))   # 秒
+ARCHIVE_BATCH_SIZE = int(os.getenv("TODO_ARCHIVE_BATCH_SIZE", "500"))
+USE_ARCHIVE = ARCHIVE_AFTER_DAYS > 0
+
+
+# 定期维护：PRAGMA optimize 会在查询计划器的统计信息过期时自动对相关表做 ANALYZE，开销很小；
+# ANALYZE 则是完整地重新收集所有统计信息（数据量变化很大之后手动执行，见 python manage.py optimize --analyze）。
+DB_OPTIMIZE_INTERVAL = int(os.getenv("TODO_DB_OPTIMIZE_INTERVAL", "3600"))   # 秒，0 表示关闭
+
+
+def optimize_database(bind=None, analyze: bool = False):
+    binds = [bind] if bind is not None else [engine] + [
+        shard.engine for shard in todo_storage.shards if shard is not todo_storage.main
+    ]
+    for target in binds:
+        with target.connect() as conn:
+            conn.exec_driver_sql("ANALYZE" if analyze else "PRAGMA optimize")
+            conn.commit()
+
+
+async def periodic_optimize(interval: int = DB_OPTIMIZE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(optimize_database)
+        except Exception:
+            logger.exception("PRAGMA optimize failed")
+
+
 # 5. 创建一个“模型基类” (Declarative Base)
 Base = declarative_base()
 # `declarative_base()` 返回一个类 `Base`。
@@ -19,4 +460,3 @@ Base = declarative_base()
 # 继承了 `Base` 的类，SQLAlchemy 就能自动将它们识别为数据库表模型，并进行映射。
 # 把它想象成一个“魔法”基类，它能让你的普通 Python 类变成数据库表。
 
-
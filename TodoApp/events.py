@@ -0,0 +1,100 @@
+import asyncio
+import os
+import threading
+
+# 进程内的事件分发中心（fan-out hub）：crud.py 的写操作提交之后调用 publish(owner_id, event)，
+# 只有这个 owner 自己的订阅者（GET /todo/events 的 SSE 连接）会收到。
+#
+# - 每个订阅者有一个有上限的队列；客户端读得太慢、队列满了，就直接断开它（发一个 overflow 事件），
+#   而不是让内存无限增长。客户端重连后用 GET /todo/changes?since= 补齐断开期间的变化。
+# - publish 可能在线程池里被调用（同步数据库模式），所以通过 call_soon_threadsafe 把事件交给订阅者所在的事件循环。
+# - 这是单进程内的：多个 worker 时，订阅者只能收到同一个进程里发生的写操作。
+
+EVENT_QUEUE_SIZE = int(os.getenv("TODO_EVENT_QUEUE_SIZE", "100"))
+MAX_SUBSCRIBERS_PER_OWNER = int(os.getenv("TODO_EVENT_MAX_SUBSCRIBERS", "10"))
+
+# 队列里的结束标记
+CLOSE = object()
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscriber:
+    def __init__(self, owner_id: int, queue_size: int):
+        self.owner_id = owner_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    # 只在 self.loop 所在的线程里执行
+    def offer(self, event):
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # 慢消费者：清空队列，只留下结束标记
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(CLOSE)
+
+
+class EventHub:
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE, max_subscribers: int = MAX_SUBSCRIBERS_PER_OWNER):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.dropped_subscribers = 0
+        self._subscribers: dict[int, set[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def has_capacity(self, owner_id: int) -> bool:
+        with self._lock:
+            return len(self._subscribers.get(owner_id, ())) < self.max_subscribers
+
+    def subscribe(self, owner_id: int) -> Subscriber:
+        subscriber = Subscriber(owner_id, self.queue_size)
+        with self._lock:
+            subscribers = self._subscribers.setdefault(owner_id, set())
+            if len(subscribers) >= self.max_subscribers:
+                raise TooManySubscribers(owner_id)
+            subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.owner_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.owner_id]
+            if subscriber.dropped:
+                self.dropped_subscribers += 1
+
+    def publish(self, owner_id: int, event: dict):
+        # 绝大多数写操作的 owner 没有在线的订阅者，这里只是一次字典查找
+        with self._lock:
+            subscribers = list(self._subscribers.get(owner_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, event)
+            except RuntimeError:
+                # 事件循环已经关闭
+                pass
+        self.published += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "owners": len(self._subscribers),
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "published": self.published,
+                "dropped_subscribers": self.dropped_subscribers,
+            }
+
+
+event_hub = EventHub()
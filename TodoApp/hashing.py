@@ -0,0 +1,75 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+# bcrypt 是故意设计得很“慢”的算法，一次 hash/verify 大约要 200ms 的 CPU。
+# 如果直接在 async def 路由里调用，这 200ms 里整个 worker 的事件循环都被占住，
+# 其它所有请求（包括 todo 接口）都只能干等。所以这里把它放进一个独立的、有大小上限的池子里执行。
+
+# 池的类型：thread（默认，bcrypt 计算时会释放 GIL，可以用上多核）或 process。
+HASH_POOL_KIND = os.getenv("TODO_HASH_POOL", "thread")
+# 最多同时有多少个 hash 在计算
+HASH_WORKERS = int(os.getenv("TODO_HASH_WORKERS", str(os.cpu_count() or 2)))
+# 最多允许多少个 hash 在排队（含正在计算的），超过就直接 503，不让登录流量拖垮整个服务。
+HASH_MAX_PENDING = int(os.getenv("TODO_HASH_MAX_PENDING", str(HASH_WORKERS * 4)))
+
+bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+_executor: Executor | None = None
+_pending = 0
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if HASH_POOL_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+
+# 进程池要求提交的函数可以被 pickle，所以这里用模块级函数，而不是直接提交 bound method。
+def _hash(password: str) -> str:
+    return bcrypt_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return bcrypt_context.verify(password, hashed_password)
+
+
+async def _submit(fn, *args):
+    global _pending
+    # 队列满了就快速失败：客户端收到 503 + Retry-After，而不是在这里越积越多。
+    if _pending >= HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, please retry later.",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    """对密码进行哈希处理（在 hash 池中执行）"""
+    return await _submit(_hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    """校验明文密码和哈希是否匹配（在 hash 池中执行）"""
+    return await _submit(_verify, password, hashed_password)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
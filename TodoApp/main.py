@@ -1,10 +1,37 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends,HTTPException, status,Path
 import models
 import crud 
+import database
+import hashing
+import archive
+import migrations
+import write_queue
 from database import engine, SessionLocal # 从 database.py 导入我们创建的那个数据库引擎
 from routers import auth, todos,admin
 
-app = FastAPI()
+
+# lifespan：应用启动时执行 yield 之前的代码，关闭时执行 yield 之后的代码
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    background_tasks = []
+    if database.DB_OPTIMIZE_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(database.periodic_optimize()))
+    if database.USE_ARCHIVE:
+        background_tasks.append(asyncio.create_task(archive.periodic_archive()))
+    if write_queue.USE_WRITE_BATCHING:
+        write_queue.group_writer.start()
+    yield
+    await write_queue.group_writer.stop()
+    for task in background_tasks:
+        task.cancel()
+    # SQLite 官方建议在关闭连接前执行一次 PRAGMA optimize
+    database.optimize_database()
+    hashing.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 步骤 2: 将 auth 路由模块“包含”到主应用中
 app.include_router(
@@ -29,4 +56,6 @@ app.include_router(
 # - `models.Base`: 我们访问到 `models.py` 文件中所有继承自 `Base` 的类（即 `Users` 和 `Todos`）。
 # - `.metadata`: `Base` 有一个特殊的属性 `metadata`，它像一个注册表，收集了所有这些模型的信息（表名、列、关系等）。
 # - `.create_all(bind=engine)`: 这个方法会告诉 `metadata`：“请检查 `engine` 连接的那个数据库，把你注册的所有表（如果它们还不存在的话）都创建出来。”
-models.Base.metadata.create_all(bind=engine)
\ No newline at end of file
+models.Base.metadata.create_all(bind=engine)
+# create_all 不会修改已经存在的表，新增的索引等由 migrations.upgrade() 补到已有的 todos.db 上（分片模式下还有每个分片文件）。
+migrations.upgrade_storage()
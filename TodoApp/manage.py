@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import sys
+
+import models
+import migrations
+import database
+import archive
+from database import engine
+
+# 运维命令：在 TodoApp 目录下执行 python manage.py <命令>
+
+
+def migrate(args):
+    models.Base.metadata.create_all(bind=engine)
+    migrations.upgrade_storage()
+    print("Migration finished.")
+
+
+def explain(args):
+    ok = True
+    for name, (uses_index, plan) in migrations.explain_router_queries(engine).items():
+        ok = ok and uses_index
+        print(f"[{'OK' if uses_index else 'FULL SCAN'}] {name}")
+        for step in plan:
+            print(f"    {step}")
+    return 0 if ok else 1
+
+
+def optimize(args):
+    database.optimize_database(analyze=args.analyze)
+    print("ANALYZE finished." if args.analyze else "PRAGMA optimize finished.")
+
+
+def rebalance_shards(args):
+    moved = migrations.rebalance_shards()
+    for path, count in moved.items():
+        print(f"{path}: moved {count} todos")
+    print(f"Rebalance finished ({len(database.todo_storage.shards)} shard(s)).")
+
+
+def stats(args):
+    if args.rebuild:
+        migrations.rebuild_todo_stats()
+        print("todo_stats rebuilt.")
+        return 0
+    ok = True
+    for path, mismatches in migrations.check_todo_stats().items():
+        ok = ok and not mismatches
+        print(f"[{'OK' if not mismatches else 'MISMATCH'}] {path}")
+        for owner_id, priority, complete, counted, actual in mismatches:
+            print(f"    owner={owner_id} priority={priority} complete={complete}: counted {counted}, actual {actual}")
+    return 0 if ok else 1
+
+
+# 在应用之外的进程里执行也没问题：归档会推进每个相关用户的数据版本（crud.get_owner_version），
+# 正在运行的服务下次请求时 ETag 和列表缓存都会对不上，重新查询。只是不会推送 SSE 事件，客户端用 /todo/changes 同步即可。
+def archive_todos(args):
+    archived = asyncio.run(archive.archive_completed(args.days))
+    print(f"Archived {archived} todos completed more than {args.days:g} days ago.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TodoApp management commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="为已有的 todos.db 补上新的索引等结构（不会丢数据）").set_defaults(func=migrate)
+    subparsers.add_parser("explain", help="检查路由里的查询是否都走了索引").set_defaults(func=explain)
+    optimize_parser = subparsers.add_parser("optimize", help="执行 PRAGMA optimize（--analyze 则完整执行 ANALYZE）")
+    optimize_parser.add_argument("--analyze", action="store_true")
+    optimize_parser.set_defaults(func=optimize)
+    subparsers.add_parser(
+        "rebalance-shards", help="按当前的 TODO_SHARDS 把已有 todos 搬到对应的分片（需要先停止应用）"
+    ).set_defaults(func=rebalance_shards)
+    stats_parser = subparsers.add_parser("stats", help="检查统计计数表 todo_stats 是否和 todos 一致（--rebuild 则重新计算）")
+    stats_parser.add_argument("--rebuild", action="store_true")
+    stats_parser.set_defaults(func=stats)
+    archive_parser = subparsers.add_parser("archive", help="立即把完成超过 --days 天的 todo 搬到归档表")
+    archive_parser.add_argument("--days", type=float, default=database.ARCHIVE_AFTER_DAYS or 30)
+    archive_parser.set_defaults(func=archive_todos)
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+import os
+
+from sqlalchemy import inspect, select, update, delete, text
+
+import crud
+import database
+from database import engine, Base
+from models import Todos, TodosArchive, TodoTombstones, TodoChangeSequence, TodoIdAllocator, TodoStats, RevokedTokens
+
+# create_all 只会创建“不存在的表”，不会给已经存在的表补新的索引/列。
+# 这里的 upgrade() 在启动时运行（也可以手动执行 python manage.py migrate），
+# 只做增量的、幂等的改动，不会删除或改写已有数据。
+
+
+# 变更序号和墓碑由触发器维护，这样单条、批量、管理员等所有写路径（包括以后新增的）都不会漏掉。
+# 写事务在 SQLite 里是串行的，所以序号的分配顺序就是提交顺序。
+# 注意 UPDATE 触发器只监听业务列，触发器自己写 change_seq 不会再次触发它。
+CHANGE_FEED_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_change_seq_insert AFTER INSERT ON todos
+    BEGIN
+        UPDATE todo_change_sequence SET value = value + 1 WHERE id = 1;
+        UPDATE todos SET change_seq = (SELECT value FROM todo_change_sequence WHERE id = 1) WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_change_seq_update
+    AFTER UPDATE OF title, description, priority, complete, owner_id ON todos
+    BEGIN
+        UPDATE todo_change_sequence SET value = value + 1 WHERE id = 1;
+        UPDATE todos SET change_seq = (SELECT value FROM todo_change_sequence WHERE id = 1) WHERE id = NEW.id;
+    END
+    """,
+    # 墓碑按 (owner_id, id) 区分（原因见 models.TodoTombstones）；同一个用户再次删除同一个 id 时只更新序号。
+    # 没有 owner 的旧数据不会出现在任何人的同步结果里，不写墓碑。
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_change_seq_delete AFTER DELETE ON todos
+    WHEN OLD.owner_id IS NOT NULL
+    BEGIN
+        UPDATE todo_change_sequence SET value = value + 1 WHERE id = 1;
+        INSERT INTO todo_tombstones (owner_id, id, change_seq)
+        VALUES (OLD.owner_id, OLD.id, (SELECT value FROM todo_change_sequence WHERE id = 1))
+        ON CONFLICT (owner_id, id) DO UPDATE SET change_seq = excluded.change_seq;
+    END
+    """,
+]
+
+
+# 全文搜索：todos_fts 是以 todos 为内容表（external content）的 FTS5 索引，只存倒排索引，不重复存一份文本。
+# owner_id 也作为一列建进索引，搜索时用列过滤 owner_id : "<id>" 和关键词求交集，只在这个用户的文档里打分排序。
+# 和变更序号一样由触发器同步，所有写路径都会覆盖到；外部内容表删除时必须给出旧值，所以 UPDATE 是先 'delete' 再插入。
+TODO_FTS_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS todos_fts USING fts5(
+        title, description, owner_id, content='todos', content_rowid='id'
+    )
+"""
+
+TODO_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_fts_insert AFTER INSERT ON todos
+    BEGIN
+        INSERT INTO todos_fts (rowid, title, description, owner_id)
+        VALUES (NEW.id, NEW.title, NEW.description, NEW.owner_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_fts_update AFTER UPDATE OF title, description, owner_id ON todos
+    BEGIN
+        INSERT INTO todos_fts (todos_fts, rowid, title, description, owner_id)
+        VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.owner_id);
+        INSERT INTO todos_fts (rowid, title, description, owner_id)
+        VALUES (NEW.id, NEW.title, NEW.description, NEW.owner_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_fts_delete AFTER DELETE ON todos
+    BEGIN
+        INSERT INTO todos_fts (todos_fts, rowid, title, description, owner_id)
+        VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.owner_id);
+    END
+    """,
+]
+
+
+# 统计计数（todo_stats）同样用触发器维护：和写入在同一个事务里，单条、批量、管理员、分片迁移都会覆盖到。
+# 没有 owner 的旧数据不计入；priority / complete 为空时按 0 计。
+_STATS_KEY = "{row}.owner_id, coalesce({row}.priority, 0), coalesce({row}.complete, 0)"
+_STATS_INCREMENT = f"""
+        INSERT INTO todo_stats (owner_id, priority, complete, count) SELECT {_STATS_KEY.format(row="NEW")}, 1
+        WHERE NEW.owner_id IS NOT NULL
+        ON CONFLICT (owner_id, priority, complete) DO UPDATE SET count = count + 1;
+"""
+_STATS_DECREMENT = """
+        UPDATE todo_stats SET count = count - 1
+        WHERE owner_id = OLD.owner_id AND priority = coalesce(OLD.priority, 0) AND complete = coalesce(OLD.complete, 0);
+"""
+# 归档的 todo 也计入统计：todos_archive 上同样有插入/删除触发器，归档和恢复时一减一加，总数不变。
+TODO_STATS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS todos_stats_insert AFTER INSERT ON todos
+    BEGIN {_STATS_INCREMENT}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS todos_stats_update AFTER UPDATE OF priority, complete, owner_id ON todos
+    BEGIN {_STATS_DECREMENT} {_STATS_INCREMENT}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS todos_stats_delete AFTER DELETE ON todos
+    BEGIN {_STATS_DECREMENT}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS todos_archive_stats_insert AFTER INSERT ON todos_archive
+    BEGIN {_STATS_INCREMENT}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS todos_archive_stats_delete AFTER DELETE ON todos_archive
+    BEGIN {_STATS_DECREMENT}
+    END
+    """,
+]
+
+# 从 todos（和归档表）重新算一遍的“正确答案”，用于首次建表回填、一致性检查和重建
+TODO_STATS_FROM_TODOS = """
+    SELECT owner_id, coalesce(priority, 0), coalesce(complete, 0), count(*) FROM (
+        SELECT owner_id, priority, complete FROM todos
+        UNION ALL SELECT owner_id, priority, complete FROM todos_archive
+    )
+    WHERE owner_id IS NOT NULL GROUP BY 1, 2, 3
+"""
+
+# 完成时间：complete 从 False 变成 True 时记下当前时间，变回 False 时清空。
+# 插入时已经带了 completed_at 的（分片迁移搬过来的行）保持原值。
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+COMPLETED_AT_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS todos_completed_at_insert AFTER INSERT ON todos
+    WHEN NEW.complete AND NEW.completed_at IS NULL
+    BEGIN
+        UPDATE todos SET completed_at = {_NOW} WHERE id = NEW.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS todos_completed_at_update AFTER UPDATE OF complete ON todos
+    WHEN NEW.complete IS NOT OLD.complete
+    BEGIN
+        UPDATE todos SET completed_at = CASE WHEN NEW.complete THEN {_NOW} END WHERE id = NEW.id;
+    END
+    """,
+]
+
+
+def _add_missing_columns(conn, table) -> list[str]:
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            added.append(column.name)
+    return added
+
+
+# 分片文件里只有 todos 相关的表（users 和 id 分配器只在 todos.db 里）
+SHARD_TABLES = [
+    Todos.__table__, TodosArchive.__table__, TodoTombstones.__table__, TodoChangeSequence.__table__, TodoStats.__table__,
+]
+
+
+# 旧版本的墓碑表只用 id 做主键。SQLite 不能修改主键，只能重建表：
+# 先删掉写墓碑的触发器（upgrade() 随后按新的写法重新创建），旧表改名，建新表，把有 owner 的墓碑搬过去。
+def _rebuild_tombstones(conn):
+    if inspect(conn).get_pk_constraint(TodoTombstones.__tablename__)["constrained_columns"] != ["id"]:
+        return
+    conn.exec_driver_sql("DROP TRIGGER IF EXISTS todos_change_seq_delete")
+    for index in TodoTombstones.__table__.indexes:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    conn.exec_driver_sql("ALTER TABLE todo_tombstones RENAME TO todo_tombstones_old")
+    TodoTombstones.__table__.create(conn)
+    conn.exec_driver_sql(
+        "INSERT INTO todo_tombstones (owner_id, id, change_seq) "
+        "SELECT owner_id, id, change_seq FROM todo_tombstones_old WHERE owner_id IS NOT NULL"
+    )
+    conn.exec_driver_sql("DROP TABLE todo_tombstones_old")
+
+
+# revoked_tokens 只在 todos.db 里；security/auth-2.py 不经过 main.py 启动，所以 token_revocation.py 自己也会调用它
+def _upgrade_revoked_tokens(conn):
+    RevokedTokens.__table__.create(conn, checkfirst=True)
+    _add_missing_columns(conn, RevokedTokens.__table__)
+    for index in RevokedTokens.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def upgrade_revoked_tokens(bind=engine):
+    with bind.begin() as conn:
+        _upgrade_revoked_tokens(conn)
+
+
+def upgrade(bind=engine, shard: bool = False):
+    with bind.begin() as conn:
+        stats_exists = inspect(conn).has_table(TodoStats.__tablename__)
+        Base.metadata.create_all(conn, tables=SHARD_TABLES if shard else None)
+        if not shard:
+            _upgrade_revoked_tokens(conn)
+        _rebuild_tombstones(conn)
+        added_columns = _add_missing_columns(conn, Todos.__table__)
+        for index in Todos.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        # 旧数据里已经完成的 todo 不知道是什么时候完成的，从现在开始计时
+        if "completed_at" in added_columns:
+            conn.exec_driver_sql(f"UPDATE todos SET completed_at = {_NOW} WHERE complete")
+
+        # 变更序号：计数器至少要比已有的所有序号大；旧数据没有序号的补上一个
+        conn.exec_driver_sql("INSERT OR IGNORE INTO todo_change_sequence (id, value) VALUES (1, 0)")
+        conn.exec_driver_sql(
+            "UPDATE todo_change_sequence SET value = max(value, (SELECT coalesce(max(change_seq), 0) FROM todos)) WHERE id = 1"
+        )
+        if conn.exec_driver_sql("SELECT 1 FROM todos WHERE change_seq IS NULL LIMIT 1").first():
+            conn.exec_driver_sql(
+                "UPDATE todos SET change_seq = id + (SELECT value FROM todo_change_sequence WHERE id = 1) WHERE change_seq IS NULL"
+            )
+            conn.exec_driver_sql(
+                "UPDATE todo_change_sequence SET value = (SELECT coalesce(max(change_seq), 0) FROM todos) WHERE id = 1"
+            )
+        for trigger in CHANGE_FEED_TRIGGERS:
+            conn.exec_driver_sql(trigger)
+
+        # 第一次创建全文索引时，把已有的 todos 全部建进去
+        fts_exists = inspect(conn).has_table("todos_fts")
+        conn.exec_driver_sql(TODO_FTS_TABLE)
+        if not fts_exists:
+            conn.exec_driver_sql("INSERT INTO todos_fts (todos_fts) VALUES ('rebuild')")
+        for trigger in TODO_FTS_TRIGGERS:
+            conn.exec_driver_sql(trigger)
+
+        if not stats_exists:
+            conn.exec_driver_sql(f"INSERT INTO todo_stats (owner_id, priority, complete, count) {TODO_STATS_FROM_TODOS}")
+        for trigger in TODO_STATS_TRIGGERS + COMPLETED_AT_TRIGGERS:
+            conn.exec_driver_sql(trigger)
+
+
+# 统计计数的一致性检查：返回 {文件: [(owner_id, priority, complete, 计数表里的值, 实际值), ...]}，只列出不一致的
+def check_todo_stats(storage=None) -> dict:
+    storage = storage or database.todo_storage
+    report = {}
+    for shard in storage.shards:
+        with shard.engine.connect() as conn:
+            expected = {tuple(row[:3]): row[3] for row in conn.exec_driver_sql(TODO_STATS_FROM_TODOS)}
+            actual = {
+                tuple(row[:3]): row[3]
+                for row in conn.exec_driver_sql("SELECT owner_id, priority, complete, count FROM todo_stats WHERE count != 0")
+            }
+        report[shard.engine.url.database] = [
+            (*key, actual.get(key, 0), expected.get(key, 0))
+            for key in sorted(expected.keys() | actual.keys())
+            if actual.get(key, 0) != expected.get(key, 0)
+        ]
+    return report
+
+
+# 重建：在一个事务里清空后从 todos 重新计算（写事务期间其它写入会等待，计数不会错位）
+def rebuild_todo_stats(storage=None):
+    storage = storage or database.todo_storage
+    for shard in storage.shards:
+        with shard.engine.begin() as conn:
+            conn.exec_driver_sql("DELETE FROM todo_stats")
+            conn.exec_driver_sql(f"INSERT INTO todo_stats (owner_id, priority, complete, count) {TODO_STATS_FROM_TODOS}")
+
+
+# 启动时对 todos.db 和所有分片执行 upgrade()
+def upgrade_storage(storage=None):
+    storage = storage or database.todo_storage
+    upgrade(storage.main.engine)
+    for shard in storage.shards:
+        if shard is not storage.main:
+            upgrade(shard.engine, shard=True)
+
+
+# ==========================
+# 分片数据迁移
+# ==========================
+# 打开分片（或者修改 TODO_SHARDS）之后，已有的 todos 还在原来的文件里：todos.db 或者按旧分片数分布的 todos_shard_*.db。
+# rebalance_shards() 把每个用户的 todos 和墓碑搬到它现在应该在的分片（TODO_SHARDS=0 时就是搬回 todos.db）。
+# - 目标分片的变更计数器先推到不小于源文件的计数器，搬过去的行由触发器重新分配序号，
+#   这样客户端手里旧的 since 仍然有效，只会多收一次这些 todo，不会漏；
+# - 先写目标、再删源，中途中断了重新执行一遍即可（幂等）；
+# - 需要在应用停止时执行：python manage.py rebalance-shards
+def _move_owner(source, target, owner_id: int) -> int:
+    with source.connect() as conn:
+        rows = conn.execute(select(Todos.__table__).where(Todos.owner_id == owner_id)).mappings().all()
+        archived_rows = conn.execute(
+            select(TodosArchive.__table__).where(TodosArchive.owner_id == owner_id)
+        ).mappings().all()
+        tombstones = conn.execute(
+            select(TodoTombstones.id).where(TodoTombstones.owner_id == owner_id)
+        ).scalars().all()
+        source_seq = conn.execute(select(TodoChangeSequence.value).where(TodoChangeSequence.id == 1)).scalar() or 0
+    with target.begin() as conn:
+        conn.execute(
+            text("UPDATE todo_change_sequence SET value = max(value, :value) WHERE id = 1"), {"value": source_seq}
+        )
+        if rows:
+            # 上次中断时已经搬过去的行先正常删掉（走触发器，全文索引才不会留下旧条目），再重新插入
+            ids = [row["id"] for row in rows]
+            conn.execute(delete(Todos).where(Todos.id.in_(ids)))
+            conn.execute(Todos.__table__.insert(), [dict(row) for row in rows])
+            # 只删这个用户自己的墓碑：别的用户可能也有同一个 id 的墓碑（id 会被复用，见 models.TodoTombstones）
+            conn.execute(
+                delete(TodoTombstones).where(TodoTombstones.owner_id == owner_id).where(TodoTombstones.id.in_(ids))
+            )
+        for tombstone_id in tombstones:
+            conn.exec_driver_sql("UPDATE todo_change_sequence SET value = value + 1 WHERE id = 1")
+            conn.execute(
+                text(
+                    "INSERT INTO todo_tombstones (owner_id, id, change_seq) "
+                    "VALUES (:owner_id, :id, (SELECT value FROM todo_change_sequence WHERE id = 1)) "
+                    "ON CONFLICT (owner_id, id) DO UPDATE SET change_seq = excluded.change_seq"
+                ),
+                {"id": tombstone_id, "owner_id": owner_id},
+            )
+        # 归档的 todo 一起搬（同样先删掉上次中断时已经搬过去的）
+        if archived_rows:
+            archived_ids = [row["id"] for row in archived_rows]
+            conn.execute(delete(TodosArchive).where(TodosArchive.id.in_(archived_ids)))
+            conn.execute(TodosArchive.__table__.insert(), [dict(row) for row in archived_rows])
+    with source.begin() as conn:
+        conn.execute(delete(Todos).where(Todos.owner_id == owner_id))
+        conn.execute(delete(TodosArchive).where(TodosArchive.owner_id == owner_id))
+        # 删除触发器刚生成的墓碑也一起删掉，这个用户的变化现在都在目标分片上
+        conn.execute(delete(TodoTombstones).where(TodoTombstones.owner_id == owner_id))
+    return len(rows) + len(archived_rows)
+
+
+def rebalance_shards(storage=None) -> dict:
+    storage = storage or database.todo_storage
+    upgrade_storage(storage)
+    engines = {os.path.abspath(shard.engine.url.database): shard.engine for shard in [storage.main, *storage.shards]}
+    sources = [storage.main.engine.url.database] + database.existing_shard_paths()
+    moved = {}
+    max_id = 0
+    for path in sources:
+        source = engines.get(os.path.abspath(path)) or database.create_sqlite_engine(f"sqlite:///{path}")
+        with source.connect() as conn:
+            if not inspect(conn).has_table(Todos.__tablename__):
+                continue
+        # 旧的分片文件（比如分片数变少之后多出来的）也先补齐表结构
+        upgrade(source, shard=source is not storage.main.engine)
+        with source.connect() as conn:
+            max_id = max(max_id, conn.execute(text(database.MAX_TODO_ID_SQL)).scalar())
+            owner_ids = conn.execute(text(
+                "SELECT owner_id FROM todos UNION SELECT owner_id FROM todo_tombstones "
+                "UNION SELECT owner_id FROM todos_archive"
+            )).scalars().all()
+        for owner_id in owner_ids:
+            if owner_id is None:
+                continue
+            target = storage.shard_for_owner(owner_id).engine
+            if target is not source:
+                moved[path] = moved.get(path, 0) + _move_owner(source, target, owner_id)
+    # 搬过来的旧 id 可能比 id 分配器已经发出去的还大，分配器直接跳到它们之后
+    with engine.begin() as conn:
+        conn.execute(
+            update(TodoIdAllocator)
+            .where(TodoIdAllocator.id == 1)
+            .values(next_block=text(f"max(next_block, {max_id // database.todo_ids.block_size + 1})"))
+        )
+    return moved
+
+
+# 路由里实际会执行的查询：直接用 crud.py 里的语句构造函数生成，和线上执行的 SQL 是同一份
+# （owner_id / id 等用的是占位值，只关心执行计划）
+def router_queries() -> dict:
+    owner_id, todo_id, since = 1, 1, 0
+    return {
+        "todos.read_all": crud.todos_page_stmt(owner_id),
+        "todos.read_all (after_id)": crud.todos_page_stmt(owner_id, after_id=todo_id, limit=100),
+        "todos.read_all (fields)": crud.todos_page_stmt(owner_id, limit=100, fields=("id", "title", "complete")),
+        "todos.read_all (include_archived)": crud.todos_page_stmt(owner_id, after_id=todo_id, limit=100,
+                                                                  include_archived=True),
+        "todos.read_todo": crud.todo_for_owner_stmt(todo_id, owner_id),
+        "todos.read_todo (fields)": crud.todo_row_stmt(todo_id, owner_id, ("id", "title")),
+        "todos.read_todo (archived)": crud.todo_row_stmt(todo_id, owner_id, archived=True),
+        "todos.update_todo": crud.update_todo_stmt(todo_id, {"title": "x"}, owner_id),
+        "todos.delete_todo": crud.delete_todo_stmt(todo_id, owner_id),
+        "todos.changes": crud.changed_todos_stmt(owner_id, since, since + 1000, 501),
+        "todos.changes (tombstones)": crud.tombstones_stmt(owner_id, since, since + 1000, 501),
+        "todos.next": crud.next_todos_stmt(owner_id, 10),
+        "todos.search": crud.search_todos_stmt(owner_id, crud.fts_query(owner_id, "learn fastapi"), 20),
+        "todos.stats": crud.todo_stats_stmt(owner_id),
+        "todos.version": crud.owner_version_stmt(owner_id),
+        "admin.read_all": crud.todos_page_stmt(None, after_id=todo_id, limit=100),
+    }
+
+
+# 按相关度排序的查询，见 explain_router_queries
+RANKED_QUERIES = {"todos.search"}
+
+
+# 对每条查询跑 EXPLAIN QUERY PLAN，返回 {名称: (是否走了索引/主键, 执行计划文本)}
+def explain_router_queries(bind=engine) -> dict:
+    report = {}
+    with bind.connect() as conn:
+        for name, stmt in router_queries().items():
+            sql = str(stmt.compile(bind, compile_kwargs={"literal_binds": True}))
+            plan = [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql))]
+            # “SCAN todos” 且没有 USING ... INDEX 就是全表扫描；admin 的全表列表按主键顺序扫描是预期的。
+            # 全文搜索的 “SCAN todos_fts VIRTUAL TABLE INDEX” 走的是 FTS 倒排索引，“SCAN CONSTANT ROW” 是没有 FROM 的外层 SELECT，都不是全表扫描。
+            # “USE TEMP B-TREE FOR ORDER BY” 说明索引没有覆盖排序，LIMIT 也得先把所有匹配的行排一遍；
+            # 按相关度（bm25）排序的查询例外，分数只能对命中的文档逐个算出来再排序。
+            uses_index = all(
+                ("USING" in step or "VIRTUAL TABLE INDEX" in step or step == "SCAN CONSTANT ROW"
+                 or not step.startswith("SCAN"))
+                and ("TEMP B-TREE" not in step or name in RANKED_QUERIES)
+                or name.startswith("admin.")
+                for step in plan
+            )
+            report[name] = (uses_index, plan)
+    return report
@@ -1,5 +1,5 @@
 from __future__ import annotations
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, PrimaryKeyConstraint
 from sqlalchemy.orm import relationship, Mapped, mapped_column, DeclarativeBase
 
 from database import Base
@@ -78,10 +78,103 @@ class Todos(Base):            # <--- 关键点 1：继承了魔法基类，当 T
     priority = Column(Integer)
     complete = Column(Boolean, default=False)
     owner_id = Column(Integer, ForeignKey("users.id"))   #alices_todos = db.query(Todos).filter(Todos.owner_id == 1).all()   查询语句有一定的局限性
+    # 变更序号：每次插入/修改都会由数据库触发器赋一个全局递增的新值（见 migrations.py），增量同步接口按它来取变化
+    change_seq = Column(Integer)
+    # 完成时间（unix 秒）：complete 变成 True 时由触发器写入，变回 False 时清空，归档任务按它判断“完成了多久”
+    completed_at = Column(Integer)
+
+    # 所有面向用户的查询都先按 owner_id 过滤，只有 id 上的索引时，每次都要全表扫描。
+    # - (owner_id, id)：read_all 的 WHERE owner_id = ? ORDER BY id（以及 id > after_id 的分页）直接走索引，不需要额外排序；
+    # - (owner_id, complete, priority)：按完成状态筛选、按优先级排序的查询。
+    # 已有的 todos.db 不会被 create_all 补上索引，由 migrations.upgrade() 负责。
+    __table_args__ = (
+        Index("ix_todos_owner_id_id", "owner_id", "id"),
+        Index("ix_todos_owner_complete_priority", "owner_id", "complete", "priority"),
+        Index("ix_todos_owner_change_seq", "owner_id", "change_seq"),
+        Index("ix_todos_completed_at", "completed_at"),
+    )
     
     def __repr__(self):
         return f"<User(id={self.id}, title='{self.title}'')>"
 
+
+# 归档表：完成很久的 todo 由归档任务（archive.py）从 todos 搬到这里，让 todos 只保留常用的“热”数据。
+# 列和 todos 一样，另外记录归档时间；和 todos 在同一个数据库文件（分片）里，搬移在一个事务里完成。
+class TodosArchive(Base):
+    __tablename__ = 'todos_archive'
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    description = Column(String)
+    priority = Column(Integer)
+    complete = Column(Boolean)
+    owner_id = Column(Integer)
+    change_seq = Column(Integer)
+    completed_at = Column(Integer)
+    archived_at = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_todos_archive_owner_id_id", "owner_id", "id"),
+    )
+
+
+# 删除记录（墓碑）：todo 被删除时由触发器写入，增量同步的客户端据此删除本地数据。
+# 主键是 (owner_id, id) 而不是 id：todos 不是 AUTOINCREMENT 表，删掉最大的 id 之后 SQLite 会把它再分给下一条插入，
+# 可能是别的用户的 todo；只按 id 做主键的话，别人再删掉这条时会覆盖掉原来那个用户的墓碑。
+class TodoTombstones(Base):
+    __tablename__ = 'todo_tombstones'
+
+    id = Column(Integer, nullable=False)            # 被删除的 todo 的 id
+    owner_id = Column(Integer, nullable=False)
+    change_seq = Column(Integer)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("owner_id", "id"),
+        Index("ix_todo_tombstones_owner_change_seq", "owner_id", "change_seq"),
+    )
+
+
+# 已撤销的 refresh token（security/auth-2.py 的 /auth/logout）：按 jti 记录，过了 token 自己的 exp 就没必要再记，
+# 由 token_revocation.py 定期清理，表的大小只和“还没过期的已注销 token”有关。
+class RevokedTokens(Base):
+    __tablename__ = 'revoked_tokens'
+
+    jti = Column(String, primary_key=True)
+    expires_at = Column(Integer, nullable=False)    # unix 秒，等于 token 的 exp
+    seq = Column(Integer)                           # 撤销的先后顺序（只增不减），各进程按它增量同步，见 token_revocation.py
+
+    __table_args__ = (
+        Index("ix_revoked_tokens_expires_at", "expires_at"),
+        Index("ix_revoked_tokens_seq", "seq"),
+    )
+
+
+# 统计计数：每个用户按 (priority, complete) 分组的 todo 数量，由 migrations.py 里的触发器在同一个事务里增减，
+# /todo/stats 直接读这几行，不用再扫描这个用户的全部 todos。
+class TodoStats(Base):
+    __tablename__ = 'todo_stats'
+
+    owner_id = Column(Integer, primary_key=True)
+    priority = Column(Integer, primary_key=True)
+    complete = Column(Boolean, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+# 分片模式下 todo id 的分配计数器（只在 todos.db 里），只有一行（id = 1），见 database.TodoIdAllocator
+class TodoIdAllocator(Base):
+    __tablename__ = 'todo_id_allocator'
+
+    id = Column(Integer, primary_key=True)
+    next_block = Column(Integer, nullable=False)
+
+
+# 全局变更序号计数器，只有一行（id = 1）
+class TodoChangeSequence(Base):
+    __tablename__ = 'todo_change_sequence'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
 # SQLAlchemy 在内部维护了一个“注册表”（就是我们之前提到的 Base.metadata），里面记录了所有这些映射关系：
 
 # Users 类 -> 'users' 表
@@ -0,0 +1,33 @@
+import json
+import os
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+# orjson 是可选依赖：装了就用（比标准库 json 快好几倍），没装就退回标准库。
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# 列表接口是否使用 FastJSONResponse，需要显式打开：TODO_FAST_JSON=1
+USE_FAST_JSON = os.getenv("TODO_FAST_JSON", "0") == "1" and orjson is not None
+
+
+def dumps(content: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(content).decode()
+    return json.dumps(content, separators=(",", ":"))
+
+
+class FastJSONResponse(JSONResponse):
+    """用 orjson 渲染的 JSONResponse（未安装 orjson 时和 JSONResponse 一样）"""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content)
+
+
+# 给列表路由用的 response_class
+ListJSONResponse = FastJSONResponse if USE_FAST_JSON else JSONResponse
@@ -1,47 +1,82 @@
 from typing import Annotated
-from pydantic import BaseModel, Field
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import APIRouter, Depends, HTTPException, Path
 from starlette import status
-from models import Todos
-from database import SessionLocal
-from .auth import get_current_user
+import crud
+from responses import ListJSONResponse
+from todo_cache import todo_list_cache
+from events import event_hub
+from user_cache import active_user_cache
+from write_queue import group_writer
+from database import busy_retry
+from database import get_db, get_read_db
+from .auth import get_current_user, token_cache
+from .todos import (TodoResponse, limit_query, after_id_query, stream_query, fields_dependency,
+                    todo_rows_response, streaming_todos_response)
 
 router = APIRouter()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+db_dependency = Annotated[Session | AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[Session | AsyncSession, Depends(get_read_db)]
+user_dependency = Annotated[dict, Depends(get_current_user)]
 
 
-db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[dict, Depends(get_current_user)]
+@router.get("/todo", status_code=status.HTTP_200_OK, response_model=list[TodoResponse],
+            response_class=ListJSONResponse)
+async def read_all(user: user_dependency, db: read_db_dependency, fields: fields_dependency,
+                   limit: limit_query = None, after_id: after_id_query = None, stream: stream_query = False):
+    if user.get('user_role') != 'admin':
+        raise HTTPException(status_code=401, detail='Authentication Failed')
+    if stream:
+        return streaming_todos_response(None, after_id, limit, fields)
+    rows = await crud.get_all_todos_async(db, after_id=after_id, limit=limit, fields=fields)
+    return todo_rows_response(rows, limit)
 
 
-@router.get("/todo", status_code=status.HTTP_200_OK)
-async def read_all(user: user_dependency, db: db_dependency):
+# 所有用户合计的统计，和 /todo/stats 的格式一样，另外多一个 owners（有 todo 的用户数）
+@router.get("/todo/stats", status_code=status.HTTP_200_OK)
+async def read_all_stats(user: user_dependency, db: read_db_dependency):
     if user.get('user_role') != 'admin':
         raise HTTPException(status_code=401, detail='Authentication Failed')
-    return db.query(Todos).all()
+    return await crud.get_all_todo_stats_async(db)
 
 
 @router.delete("/todo/{todo_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_todo(user: user_dependency, db: db_dependency, todo_id: int = Path(gt=0)):
     if user.get('user_role') != 'admin':
         raise HTTPException(status_code=401, detail='Authentication Failed')
-    todo_model = db.query(Todos).filter(Todos.id == todo_id).first()
+    todo_model = await crud.admin_delete_todo_async(db, todo_id)
     if todo_model is None:
         raise HTTPException(status_code=404, detail='Todo not found.')
-    db.query(Todos).filter(Todos.id == todo_id).delete()
-    db.commit()
-
-
-
 
 
+class UserUpdateRequest(BaseModel):
+    role: str | None = None
+    is_active: bool | None = None
 
 
+# 修改用户的角色或停用用户：本进程立即生效，其它 worker 在用户缓存的 TTL（TODO_USER_CACHE_TTL）之内生效
+@router.patch("/user/{user_id}", status_code=status.HTTP_200_OK)
+async def update_user(user: user_dependency, db: db_dependency, user_request: UserUpdateRequest,
+                      user_id: int = Path(gt=0)):
+    if user.get('user_role') != 'admin':
+        raise HTTPException(status_code=401, detail='Authentication Failed')
+    values = user_request.model_dump(exclude_unset=True, exclude_none=True)
+    if not values:
+        raise HTTPException(status_code=422, detail='Nothing to update')
+    updated_user = await crud.update_user_async(db, user_id, values)
+    if updated_user is None:
+        raise HTTPException(status_code=404, detail='User not found.')
+    return dict(updated_user._mapping)
+
+
+# 进程内缓存（列表、token、用户）的命中率和内存占用，以及事件推送、分组提交、锁冲突重试的计数
+@router.get("/cache", status_code=status.HTTP_200_OK)
+async def cache_stats(user: user_dependency):
+    if user.get('user_role') != 'admin':
+        raise HTTPException(status_code=401, detail='Authentication Failed')
+    return {"todo_list": todo_list_cache.stats(), "token": token_cache.stats(), "user": active_user_cache.stats(),
+            "events": event_hub.stats(), "write_queue": group_writer.stats(), "busy_retry": busy_retry.stats()}
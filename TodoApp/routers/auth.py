@@ -4,10 +4,13 @@ from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from pydantic import BaseModel, Field
-from models import Users
 from sqlalchemy.orm import Session 
-from passlib.context import CryptContext
-from database import SessionLocal, engine
+from sqlalchemy.ext.asyncio import AsyncSession
+import crud
+import hashing
+from token_cache import VerifiedTokenCache
+from user_cache import active_user_cache
+from database import get_db, shard_session, todo_storage
 import jwt
 from jwt.exceptions import InvalidTokenError
 
@@ -24,21 +27,13 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-def  get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-    
-
-# 1. 创建 CryptContext 实例
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+# 1. CryptContext 实例放在 hashing.py 中，bcrypt 计算在独立的有界线程/进程池里进行，不占用事件循环
+bcrypt_context = hashing.bcrypt_context
 
 # 2. 创建一个密码哈希的辅助函数
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """对密码进行哈希处理"""
-    return bcrypt_context.hash(password)
+    return await hashing.hash_password(password)
 
 class CreateUserRequest(BaseModel):
     username: str
@@ -49,11 +44,11 @@ class CreateUserRequest(BaseModel):
     role: str
     is_active: bool = True 
 
-db_dependency =  Annotated[Session, Depends(get_db)]
+db_dependency =  Annotated[Session | AsyncSession, Depends(get_db)]
 
-def authenticate_user(username: str, password: str,  db):
-    user = db.query(Users).filter(Users.username == username).first()
-    if not user or not bcrypt_context.verify(password, user.hashed_password):
+async def authenticate_user(username: str, password: str,  db):
+    user = await crud.get_user_by_username_async(db, username)
+    if not user or not await hashing.verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -69,26 +64,48 @@ def create_access_token(username: str, user_id: int, role: str, expires_delta: t
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
 # 检查门票：如果一个请求来了，并且是访问受保护的资源（比如一个需要登录的接口），服务器的“保安” (get_current_user 函数) 就会说：“请出示你的门票（Token）！”
+# 验证过的 token 会被缓存到它的 exp 为止，热路径上只需要一次字典查找，见 token_cache.py
+token_cache = VerifiedTokenCache()
+
+# token 只证明“签发时”是谁；用户现在是否还启用、现在是什么角色，以 users 表为准（带 TTL 缓存，见 user_cache.py）
+async def get_active_user(user_id: int) -> dict:
+    user = active_user_cache.get(user_id)
+    if user is not None:
+        return user
+    # users 表在 todos.db 里（分片模式下也一样）
+    async with shard_session(todo_storage.main, read_only=True) as db:
+        row = await crud.get_user_for_auth_async(db, user_id)
+    user = dict(row._mapping) if row is not None else {"id": user_id, "is_active": False}
+    active_user_cache.put(user_id, user)
+    return user
+
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    claims = token_cache.get(token)
+    if claims is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except InvalidTokenError:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user.")
         username: str = payload.get("sub")
         user_id: int = payload.get("id")
-        user_role: str = payload.get("role")
         if username is None or user_id is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user.")
-        return {"username": username, "id": user_id, "user_role": user_role}
-    except InvalidTokenError:
+        claims = {"username": username, "id": user_id}
+        token_cache.put(token, claims, payload.get("exp"))
+    user = await get_active_user(claims["id"])
+    # 被停用（或已删除）的用户，token 还没过期也不能再用
+    if not user["is_active"]:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user.")
+    return {"username": user["username"], "id": user["id"], "user_role": user["role"]}
 
 
 @router.post("/user", status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency, create_user_request: CreateUserRequest):
     
-    existing_user = db.query(Users).filter(
-        (Users.username == create_user_request.username) | 
-        (Users.email == create_user_request.email)
-    ).first()
+    existing_user = await crud.get_user_by_username_or_email_async(
+        db, create_user_request.username, create_user_request.email
+    )
     
     if existing_user:
         raise HTTPException(
@@ -97,14 +114,11 @@ async def create_user(db: db_dependency, create_user_request: CreateUserRequest)
         )
     user_data = create_user_request.model_dump(exclude={"password"})
     
-    create_user_model = Users(
-        **user_data,   # 字典解包”（Dictionary Unpacking),将键值对转为关键字参数
-        hashed_password=get_password_hash(create_user_request.password)
+    create_user_model = await crud.create_user_async(
+        db,
+        user_data,   # 在 crud.create_user 中通过字典解包（Dictionary Unpacking）转为关键字参数
+        hashed_password=await get_password_hash(create_user_request.password)
     )
-    
-    db.add(create_user_model)
-    db.commit()
-    db.refresh(create_user_model)
     return create_user_model
     # print(f'message: User created successfully, username: {create_user_model.username}')
     # return create_user_model
@@ -113,7 +127,7 @@ async def create_user(db: db_dependency, create_user_request: CreateUserRequest)
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
                                  db: db_dependency):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail='Could not validate user.')
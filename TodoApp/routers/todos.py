@@ -1,11 +1,15 @@
+import asyncio
 from typing import Annotated
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends,HTTPException, status,Path
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends,HTTPException, status,Path, Query, Body, Response, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-import models
 import crud 
-from models import Todos
-from database import engine, SessionLocal # 从 database.py 导入我们创建的那个数据库引擎
+from responses import ListJSONResponse, dumps
+from todo_cache import todo_list_cache
+from events import event_hub, CLOSE, TooManySubscribers
+from database import owner_session # 从 database.py 导入按用户取数据库会话的方法
 
 from .auth import get_current_user
 
@@ -31,15 +35,40 @@ class TodoRequest(BaseModel):
     }
 
 
+# 响应模型：声明之后 FastAPI 会用 Pydantic（from_attributes 直接读取 ORM 对象的属性）做校验和序列化，
+# 而不是让 jsonable_encoder 在运行时逐个去“猜”每个对象怎么转成 JSON，大列表时快得多，也让 OpenAPI 文档更准确。
+class TodoResponse(BaseModel):
+    id: int
+    title: str | None = None
+    description: str | None = None
+    priority: int | None = None
+    complete: bool | None = None
+    owner_id: int | None = None
+    change_seq: int | None = None
+    completed_at: int | None = None
 
+    model_config = {"from_attributes": True}
 
-def get_db():
-    db = SessionLocal()  # 1. 创建一个数据库会话, 从database.py 里的 SessionLocal会话工厂，取出一个全新的、干净的数据库会话 db
-    try:
 
-        yield db         # 2. “产出”或“提供”这个会话， 程序执行到这里会暂停，然后把 db 对象“注入”到需要它的地方（比如我们的 API 路由函数）。
-    finally:
-        db.close()       # 3. 当依赖 get_db 的代码（也就是我们的 API 路由函数）执行完毕后，无论是成功返回了结果，还是中途发生了错误，程序的控制权都会回到 yield db 暂停的地方。然后，程序继续向下执行，进入 finally 块。
+class TodoBatchUpdateRequest(TodoRequest):
+    id: int = Field(gt=0)
+
+
+# 一个批次最多多少条，防止单个请求占住写锁太久
+MAX_BATCH_SIZE = 500
+
+batch_create_body = Annotated[list[TodoRequest], Body(min_length=1, max_length=MAX_BATCH_SIZE)]
+batch_update_body = Annotated[list[TodoBatchUpdateRequest], Body(min_length=1, max_length=MAX_BATCH_SIZE)]
+batch_delete_body = Annotated[list[Annotated[int, Field(gt=0)]], Body(min_length=1, max_length=MAX_BATCH_SIZE)]
+
+
+def check_unique_ids(ids: list[int]):
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=422, detail='Duplicate todo ids in batch')
+
+
+# get_db 统一定义在 database.py 中：它和原来一样是一个带 yield 的依赖，
+# 只是会根据配置（TODO_ASYNC_DB）产出同步 Session 或 AsyncSession。
 
 # FastAPI 的执行流程：
 # 当一个客户端请求访问服务器的根路径 / 时，FastAPI 会做以下事情：
@@ -55,45 +84,292 @@ def get_db():
 # 步骤 I: get_db 函数执行 finally 块中的 db.close()，安全地关闭了会话。
 
 
-db_dependency =  Annotated[Session, Depends(get_db)]
 user_dependency =  Annotated[dict, Depends(get_current_user)]
 
 
+# todo 路由的会话跟着当前用户走：分片模式下（TODO_SHARDS）打开这个用户所在分片的会话，
+# 不分片时就是 todos.db，和 database.get_db / get_read_db 完全一样。crud.py 里的函数不需要知道数据在哪个文件。
+async def get_owner_db(user: user_dependency):
+    async with owner_session(user.get('id')) as db:
+        yield db
+
+
+async def get_owner_read_db(user: user_dependency):
+    async with owner_session(user.get('id'), read_only=True) as db:
+        yield db
+
+
+db_dependency =  Annotated[Session | AsyncSession, Depends(get_owner_db)]
+# GET 路由使用只读会话，见 database.get_read_db
+read_db_dependency =  Annotated[Session | AsyncSession, Depends(get_owner_read_db)]
+
+# 列表接口的分页参数：limit 不传时保持原来的行为（返回全部），after_id 是上一页最后一条的 id。
+limit_query = Annotated[int | None, Query(gt=0, le=1000)]
+after_id_query = Annotated[int | None, Query(ge=0)]
+stream_query = Annotated[bool, Query(description="分块流式返回 JSON 数组，内存占用不随行数增长")]
+
+
+# 稀疏字段：fields=id,title,priority,complete 只查询并返回这些列（列表视图用不到 description 时可以少读少传）。
+# id 总是会返回（翻页游标和分片归并都要用到）；字段按 todos 表的列顺序输出。
+def parse_fields(fields: Annotated[str | None, Query(
+    description="逗号分隔的字段名，只返回这些字段，例如 id,title,priority,complete"
+)] = None) -> tuple[str, ...] | None:
+    if fields is None:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(crud.TODO_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add("id")
+    return tuple(name for name in crud.TODO_FIELDS if name in requested)
+
+
+fields_dependency = Annotated[tuple[str, ...] | None, Depends(parse_fields)]
+
+# 归档的 todo 默认不出现在读接口里，include_archived=true 时一起返回，并带上 archived 字段
+include_archived_query = Annotated[bool, Query(description="同时返回已归档的 todo（每条带 archived 字段）")]
+
+
+# 条件请求：客户端带上次拿到的 ETag 放在 If-None-Match 里，版本号没变就直接回 304，只查一次版本号，不查列表也不序列化。
+if_none_match_header = Annotated[str | None, Header()]
+
+
+# 强 ETag：owner + 数据版本（crud.get_owner_version，所有 worker 看到的都一样）+ 调用方给的区分字段（比如分页参数、todo id）
+def make_etag(owner_id: int, version: int, *parts) -> str:
+    return '"' + ".".join(str(field) for field in (owner_id, version, *parts)) + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match 使用弱比较，W/ 前缀忽略
+    candidates = (candidate.strip().removeprefix("W/") for candidate in if_none_match.split(","))
+    return etag in candidates
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+def set_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    # private：只允许客户端自己缓存；no-cache：每次使用前都要带 If-None-Match 回来验证
+    response.headers["Cache-Control"] = "private, no-cache"
+
+
+# 列表接口拿到的是 Core 查询的行元组，直接编码成 JSON 返回（不经过 ORM 对象和 response_model 校验），
+# 输出和 TodoResponse 完全一致。
+def todo_rows_response(rows: list, limit: int | None):
+    response = ListJSONResponse(crud.rows_to_dicts(rows))
+    # 本页取满了，说明后面可能还有数据：把下一页的游标放在响应头里
+    if limit is not None and len(rows) == limit:
+        response.headers["X-Next-After-Id"] = str(rows[-1].id)
+    return response
+
+
+def streaming_todos_response(owner_id: int | None, after_id: int | None, limit: int | None,
+                             fields: tuple[str, ...] | None = None, include_archived: bool = False):
+    async def body():
+        yield "["
+        first = True
+        async for chunk in crud.iter_todo_chunks(owner_id=owner_id, after_id=after_id, limit=limit, fields=fields,
+                                                 include_archived=include_archived):
+            if not chunk:
+                continue
+            yield ("" if first else ",") + ",".join(dumps(row) for row in chunk)
+            first = False
+        yield "]"
+    return StreamingResponse(body(), media_type="application/json")
+
+
 @router.post("/todo", status_code=status.HTTP_201_CREATED)
 async def create_todo_route(user : user_dependency, db: db_dependency, to_request: TodoRequest):
-    crud.create_todo(db=db, todo_data=to_request, id=user['id'])
+    await crud.create_todo_async(db=db, todo_data=to_request, id=user['id'])
     # 你甚至可以返回创建的对象，如果你在 crud 函数中 return 的话
 
 @router.put("/todo/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def update_todo_route(db: db_dependency, id: int, todo_request: TodoRequest):
-    updated_todo = crud.update_todo(db=db, todo_id=id, todo_data=todo_request)
+async def update_todo_route(user : user_dependency, db: db_dependency, id: int, todo_request: TodoRequest):
+    updated_todo = await crud.update_todo_async(db=db, todo_id=id, todo_data=todo_request, owner_id=user['id'])
     if updated_todo is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Todo not found')
     
 
 @router.delete("/todo/{id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_todo_route(db: db_dependency, id: int):
-    delete_todo = crud.delete_tode(db=db, todo_id=id)
+async def delete_todo_route(user : user_dependency, db: db_dependency, id: int):
+    delete_todo = await crud.delete_tode_async(db=db, todo_id=id, owner_id=user['id'])
     if delete_todo is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Todo not found')
     
 
-@router.get("/")
+# ==========================
+# 批量接口：整批校验，一个事务写入，返回逐条结果
+# ==========================
+@router.post("/todos:batch", status_code=status.HTTP_201_CREATED)
+async def create_todos_batch(user: user_dependency, db: db_dependency, todo_requests: batch_create_body):
+    return await crud.create_todos_async(db, todo_requests, user['id'])
+
+
+@router.put("/todos:batch", status_code=status.HTTP_200_OK)
+async def update_todos_batch(user: user_dependency, db: db_dependency, todo_requests: batch_update_body):
+    check_unique_ids([todo_request.id for todo_request in todo_requests])
+    return await crud.update_todos_async(db, todo_requests, user['id'])
+
+
+@router.delete("/todos:batch", status_code=status.HTTP_200_OK)
+async def delete_todos_batch(user: user_dependency, db: db_dependency, todo_ids: batch_delete_body):
+    check_unique_ids(todo_ids)
+    return await crud.delete_todos_async(db, todo_ids, user['id'])
+
+
+@router.get("/", response_model=list[TodoResponse], response_class=ListJSONResponse)
 #db: Session 是一个类型提示。它告诉你的编辑器（如 VS Code）和代码检查工具：“db 这个变量的类型是 SQLAlchemy 的 Session”。这能给你带来非常好的代码自动补全和类型检查功能。当你输入 db. 时，编辑器就会智能地提示你 query(), add(), commit() 等方法。
 #Annotated[Session, Depends(get_db)] 是 Python 3.9+ 引入的一种更清晰的类型提示方式，它能将类型信息（Session）和 FastAPI 的元数据（Depends）优雅地结合在一起。功能上和 db: Session = Depends(get_db) 完全一样。
 
 # async def read_all(db: Annotated[Session, Depends(get_db)]):
-async def read_all(user : user_dependency, db: Annotated[Session, Depends(get_db)]):
-    return db.query(Todos).filter(Todos.owner_id  == user.get('id')).all()
+async def read_all(user : user_dependency, db: read_db_dependency, fields: fields_dependency,
+                   if_none_match: if_none_match_header = None,
+                   limit: limit_query = None, after_id: after_id_query = None, stream: stream_query = False,
+                   include_archived: include_archived_query = False):
+    if stream:
+        return streaming_todos_response(user.get('id'), after_id, limit, fields, include_archived)
+    # 先取版本号再查询：查询期间如果有写入，这个 ETag 只会“偏旧”，下次请求时自然对不上，拿到新数据
+    version = await crud.get_owner_version_async(db, user.get('id'))
+    etag = make_etag(user.get('id'), version, "list", limit, after_id, include_archived, *(fields or ()))
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag)
+    # 列表缓存只存完整字段、不含归档的整个列表
+    if (limit is not None or after_id is not None or fields is not None or include_archived
+            or not todo_list_cache.enabled):
+        rows = await crud.get_todos_by_owner_async(db, user.get('id'), after_id=after_id, limit=limit, fields=fields,
+                                                   include_archived=include_archived)
+        response = todo_rows_response(rows, limit)
+        set_etag(response, etag)
+        return response
+    # 完整列表走缓存：版本号对得上就直接返回缓存的响应体，不查列表也不重新序列化
+    cached_body = todo_list_cache.get(user.get('id'), version)
+    if cached_body is not None:
+        response = Response(content=cached_body, media_type="application/json")
+        set_etag(response, etag)
+        return response
+    rows = await crud.get_todos_by_owner_async(db, user.get('id'))
+    response = todo_rows_response(rows, None)
+    todo_list_cache.put(user.get('id'), version, response.body)
+    set_etag(response, etag)
+    return response
+
+
+# 增量同步：客户端保存上次返回的 next_since，下次只拿这之后的变化（必须定义在 /todo/{id} 之前）
+@router.get("/todo/changes", status_code=status.HTTP_200_OK)
+async def read_changes(user: user_dependency, db: read_db_dependency,
+                       since: Annotated[int, Query(ge=0)] = 0,
+                       limit: Annotated[int, Query(gt=0, le=1000)] = 500):
+    return await crud.get_changes_async(db, user.get('id'), since, limit)
+
+
+# 按优先级和完成状态统计自己的 todo 数量（同样要定义在 /todo/{id} 之前）
+@router.get("/todo/stats", status_code=status.HTTP_200_OK)
+async def read_stats(user: user_dependency, db: read_db_dependency):
+    return await crud.get_todo_stats_async(db, user.get('id'))
+
+
+# 优先级最高的 k 条未完成 todo（priority 小的在前，相同时按 id），同样要定义在 /todo/{id} 之前
+@router.get("/todo/next", status_code=status.HTTP_200_OK, response_model=list[TodoResponse],
+            response_class=ListJSONResponse)
+async def read_next(user: user_dependency, db: read_db_dependency, if_none_match: if_none_match_header = None,
+                    k: Annotated[int, Query(gt=0, le=100)] = 10):
+    version = await crud.get_owner_version_async(db, user.get('id'))
+    etag = make_etag(user.get('id'), version, "next", k)
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag)
+    rows = await crud.get_next_todos_async(db, user.get('id'), k)
+    response = todo_rows_response(rows, None)
+    set_etag(response, etag)
+    return response
+
+
+# 全文搜索标题和描述，按相关度排序，只返回自己的 todo（同样要定义在 /todo/{id} 之前）
+@router.get("/todo/search", status_code=status.HTTP_200_OK, response_model=list[TodoResponse],
+            response_class=ListJSONResponse)
+async def search_todos(user: user_dependency, db: read_db_dependency,
+                       q: Annotated[str, Query(min_length=1, max_length=200)],
+                       limit: Annotated[int, Query(gt=0, le=100)] = 20):
+    rows = await crud.search_todos_async(db, user.get('id'), q, limit)
+    return todo_rows_response(rows, None)
+
+
+# 实时推送（Server-Sent Events）：用和其它接口一样的 Bearer token 鉴权，
+# 有写操作时服务端主动推送 {"op": "created" | "updated" | "deleted", "ids": [...]}，客户端不再需要轮询。
+# 被当作慢消费者断开时会收到 overflow 事件，重连后用 /todo/changes 补齐即可。
+EVENT_HEARTBEAT_SECONDS = 15
+
+
+# 这里只检查名额，真正的订阅在响应体开始发送时（生成器里）才做：客户端在第一块数据之前就断开的话，
+# 生成器根本不会启动，finally 也就不会执行，提前订阅的名额会一直占着，直到重启。
+@router.get("/todo/events", status_code=status.HTTP_200_OK)
+async def todo_events(user: user_dependency):
+    if not event_hub.has_capacity(user.get('id')):
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail='Too many event streams')
+
+    async def event_stream():
+        try:
+            subscriber = event_hub.subscribe(user.get('id'))
+        except TooManySubscribers:
+            # 检查名额之后、开始发送之前，名额被同时建立的其它连接占满了
+            yield "event: error\ndata: {\"detail\": \"Too many event streams\"}\n\n"
+            return
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # 心跳注释行，防止代理把空闲连接断掉
+                    yield ": ping\n\n"
+                    continue
+                if event is CLOSE:
+                    yield "event: overflow\ndata: {}\n\n"
+                    break
+                yield f"event: {event['op']}\ndata: {dumps(event)}\n\n"
+        finally:
+            event_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# 把归档的 todo 恢复到正常列表里（id 不变）
+@router.post("/todo/{id}/restore", status_code=status.HTTP_200_OK, response_model=TodoResponse)
+async def restore_todo_route(user: user_dependency, db: db_dependency, id: int = Path(gt=0)):
+    restored_todo = await crud.restore_todo_async(db, id, user['id'])
+    if restored_todo is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Archived todo not found')
+    return restored_todo
 
 
-@router.get("/todo/{id}", status_code=status.HTTP_200_OK)
-async def read_todo(user : user_dependency, db: db_dependency, id: int = Path(gt=0) ):
+@router.get("/todo/{id}", status_code=status.HTTP_200_OK, response_model=TodoResponse)
+async def read_todo(user : user_dependency, db: read_db_dependency, response: Response, fields: fields_dependency,
+                    if_none_match: if_none_match_header = None, id: int = Path(gt=0),
+                    include_archived: include_archived_query = False):
+    # 单条 todo 的 ETag 用的也是 owner 的版本号：这个用户的任何写操作都会让它变化
+    version = await crud.get_owner_version_async(db, user.get('id'))
+    etag = make_etag(user.get('id'), version, "todo", id, include_archived, *(fields or ()))
+    if etag_matches(if_none_match, etag):
+        return not_modified_response(etag)
+    if fields is not None or include_archived:
+        # 只取部分列（或者要带 archived 字段）：直接返回查到的字段，不经过 response_model（否则其它字段会以 null 出现）
+        row = await crud.get_todo_row_for_owner_async(db, id, user.get('id'), fields, include_archived)
+        if row is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='todo id not found')
+        partial_response = ListJSONResponse(dict(row._mapping))
+        set_etag(partial_response, etag)
+        return partial_response
     #如果数据库返回了任何结果，请把第一行数据转换成一个 Todos 的 Python 对象实例，然后返回给我。”
-    todo_model = db.query(Todos).filter(Todos.id == id).\
-    filter(Todos.owner_id  == user.get('id')).first()
+    todo_model = await crud.get_todo_for_owner_async(db, id, user.get('id'))
     
     if todo_model:
+        set_etag(response, etag)
         return todo_model
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='todo id not found')
 
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# 测试在一个临时目录里运行：database.py 用的是相对路径 ./todos.db，必须在导入应用模块之前切换目录，
+# 这样不会碰到仓库里的 todos.db。应用模块都是平铺导入的（import crud），所以把 TodoApp 加进 sys.path。
+TODO_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="todoapp-tests-"))
+sys.path.insert(0, TODO_APP_DIR)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+# 每次调用注册一个新用户并登录，返回带 Authorization 头的字典；测试之间共用一个数据库，用户名不会重复
+@pytest.fixture
+def make_user(client):
+    def make(role: str = "user") -> dict:
+        username = f"user_{uuid.uuid4().hex[:8]}"
+        response = client.post("/auth/user", json={
+            "username": username, "email": f"{username}@example.com", "first_name": "Test", "last_name": "User",
+            "password": "secret", "role": role,
+        })
+        assert response.status_code == 201
+        token = client.post("/auth/token", data={"username": username, "password": "secret"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+    return make
+
+
+@pytest.fixture
+def create_todo(client):
+    def create(headers: dict, title: str = "Test todo", complete: bool = False) -> int:
+        response = client.post("/todo", headers=headers, json={
+            "title": title, "description": "test description", "priority": 3, "complete": complete,
+        })
+        assert response.status_code == 201
+        return max(todo["id"] for todo in client.get("/", headers=headers).json())
+    return create
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+from conftest import TODO_APP_DIR
+
+
+# python manage.py archive 在另一个进程里执行，不会调用本进程的 todos_changed；
+# 正在运行的服务仍然要通过数据版本看到变化：旧 ETag 不能再回 304，缓存的列表里也不能再有归档的 todo
+def test_archive_from_cli_is_visible_to_running_server(client, make_user, create_todo):
+    headers = make_user()
+    open_id = create_todo(headers, title="Still open")
+    done_id = create_todo(headers, title="Done long ago", complete=True)
+    etag = client.get("/", headers=headers).headers["ETag"]
+    assert {todo["id"] for todo in client.get("/", headers=headers).json()} == {open_id, done_id}
+
+    subprocess.run([sys.executable, os.path.join(TODO_APP_DIR, "manage.py"), "archive", "--days", "0"],
+                   check=True, capture_output=True)
+
+    response = client.get("/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert [todo["id"] for todo in response.json()] == [open_id]
+    assert [todo["id"] for todo in client.get("/", headers=headers).json()] == [open_id]
+    archived = client.get("/", headers=headers, params={"include_archived": True}).json()
+    assert {(todo["id"], todo["archived"]) for todo in archived} == {(open_id, False), (done_id, True)}
+
+    # 归档走了当前最大的 id，之后新建的 todo 也不能拿到同一个 id，否则归档的那条就恢复不回来了
+    new_id = create_todo(headers, title="Created after archive")
+    assert new_id not in {open_id, done_id}
+    archived_ids = [todo["id"] for todo in client.get("/", headers=headers, params={"include_archived": True}).json()]
+    assert sorted(archived_ids) == sorted({open_id, done_id, new_id})
+
+    response = client.post(f"/todo/{done_id}/restore", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == done_id
+    assert {todo["id"] for todo in client.get("/", headers=headers).json()} == {open_id, done_id, new_id}
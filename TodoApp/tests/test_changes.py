@@ -0,0 +1,47 @@
+from sqlalchemy import text
+
+import database
+
+
+def changes(client, headers: dict, since: int) -> dict:
+    response = client.get("/todo/changes", headers=headers, params={"since": since})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_changes_report_updates_and_deletes(client, make_user, create_todo):
+    headers = make_user()
+    since = changes(client, headers, 0)["next_since"]
+    kept_id = create_todo(headers)
+    deleted_id = create_todo(headers)
+    assert client.delete(f"/todo/{deleted_id}", headers=headers).status_code == 204
+
+    feed = changes(client, headers, since)
+    assert [(change["op"], change.get("id") or change["todo"]["id"]) for change in feed["changes"]] == [
+        ("upsert", kept_id), ("delete", deleted_id),
+    ]
+    assert changes(client, headers, feed["next_since"])["changes"] == []
+
+
+# 同一个 id 在不同用户名下都删过（SQLite 自增复用 id、迁移或手工导入都会出现）：
+# 别的用户删掉它，不能覆盖第一个用户的墓碑。撞号的那条直接通过连接按同一个 id 插进别的用户所在的库。
+def test_reused_id_keeps_each_owners_tombstone(client, make_user, create_todo):
+    owner, other = make_user(), make_user()
+    other_id = client.get(f"/todo/{create_todo(other)}", headers=other).json()["owner_id"]
+    since = changes(client, owner, 0)["next_since"]
+    todo_id = create_todo(owner)
+    assert client.delete(f"/todo/{todo_id}", headers=owner).status_code == 204
+
+    with database.todo_storage.shard_for_owner(other_id).engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO todos (id, title, description, priority, complete, owner_id) "
+            "VALUES (:id, 'Reused id', 'test description', 3, 0, :owner_id)"
+        ), {"id": todo_id, "owner_id": other_id})
+    assert client.delete(f"/todo/{todo_id}", headers=other).status_code == 204
+
+    feed = changes(client, owner, since)
+    assert [change for change in feed["changes"] if change["op"] == "delete"] == [
+        {"seq": feed["changes"][-1]["seq"], "op": "delete", "id": todo_id},
+    ]
+    other_feed = changes(client, other, since)
+    assert [change["id"] for change in other_feed["changes"] if change["op"] == "delete"] == [todo_id]
@@ -0,0 +1,82 @@
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+import database
+
+UPDATED_TODO = {"title": "Updated todo", "description": "updated description", "priority": 2, "complete": True}
+
+
+TODOS_STATEMENT = re.compile(r"\btodos\b")
+
+
+# 所有可能写 todos 的 engine：todos.db 和每个分片（TODO_SHARDS），以及它们的异步引擎底下的同步引擎（TODO_ASYNC_DB）。
+# 分组提交（TODO_WRITE_BATCHING）的 writer 用的是分片的同步引擎，也在里面。
+def todo_engines() -> list:
+    engines = {}
+    for shard in [database.todo_storage.main, *database.todo_storage.shards]:
+        engines[id(shard.engine)] = shard.engine
+        if shard.AsyncSessionLocal is not None:
+            async_engine = shard.AsyncSessionLocal.kw["bind"].sync_engine
+            engines[id(async_engine)] = async_engine
+    return list(engines.values())
+
+
+# 记录请求期间执行的、涉及 todos 表的 SQL 语句。鉴权查 users（TODO_READ_POOL=0 时和写共用一个 engine）不计入，
+# 触发器里的语句不经过游标，也不计入。
+@contextmanager
+def count_statements():
+    statements = []
+    engines = todo_engines()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if TODOS_STATEMENT.search(statement):
+            statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_update_is_a_single_statement(client, make_user, create_todo):
+    headers = make_user()
+    todo_id = create_todo(headers)
+    with count_statements() as statements:
+        response = client.put(f"/todo/{todo_id}", headers=headers, json=UPDATED_TODO)
+    assert response.status_code == 204
+    assert len(statements) == 1
+    assert statements[0].startswith("UPDATE todos")
+
+
+def test_delete_is_a_single_statement(client, make_user, create_todo):
+    headers = make_user()
+    todo_id = create_todo(headers)
+    with count_statements() as statements:
+        response = client.delete(f"/todo/{todo_id}", headers=headers)
+    assert response.status_code == 204
+    assert len(statements) == 1
+    assert statements[0].startswith("DELETE FROM todos")
+
+
+def test_not_found_is_a_single_statement(client, make_user):
+    headers = make_user()
+    with count_statements() as statements:
+        assert client.put("/todo/999999", headers=headers, json=UPDATED_TODO).status_code == 404
+        assert client.delete("/todo/999999", headers=headers).status_code == 404
+    assert len(statements) == 2
+
+
+def test_wrong_owner_is_a_single_statement(client, make_user, create_todo):
+    owner, other = make_user(), make_user()
+    todo_id = create_todo(owner)
+    with count_statements() as statements:
+        assert client.put(f"/todo/{todo_id}", headers=other, json=UPDATED_TODO).status_code == 404
+        assert client.delete(f"/todo/{todo_id}", headers=other).status_code == 404
+    assert len(statements) == 2
+    # 别人的请求没有改动这条 todo
+    assert client.get(f"/todo/{todo_id}", headers=owner).json()["title"] == "Test todo"
@@ -0,0 +1,57 @@
+from sqlalchemy import text
+
+import database
+
+
+# 模拟另一个 worker / 进程：单独的 engine 和连接，不经过本进程的 crud.py，也就不会调用 todos_changed。
+# 写到这个用户的 todo 所在的文件（TODO_SHARDS 打开时是它的分片）。
+def write_from_other_process(owner_id: int, sql: str, **params):
+    other_engine = database.create_sqlite_engine(database.todo_storage.shard_for_owner(owner_id).engine.url)
+    try:
+        with other_engine.begin() as conn:
+            conn.execute(text(sql), params)
+    finally:
+        other_engine.dispose()
+
+
+def test_etag_is_stable_without_writes(client, make_user, create_todo):
+    headers = make_user()
+    create_todo(headers)
+    etag = client.get("/", headers=headers).headers["ETag"]
+    response = client.get("/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_write_from_other_process_changes_etag_and_cache(client, make_user, create_todo):
+    headers = make_user()
+    todo_id = create_todo(headers, title="Original title")
+    # 第一次读取把列表放进缓存，第二次确认命中
+    etag = client.get("/", headers=headers).headers["ETag"]
+    assert client.get("/", headers=headers).json()[0]["title"] == "Original title"
+    todo_response = client.get(f"/todo/{todo_id}", headers=headers)
+    todo_etag = todo_response.headers["ETag"]
+
+    write_from_other_process(todo_response.json()["owner_id"], "UPDATE todos SET title = 'Changed elsewhere' WHERE id = :id", id=todo_id)
+
+    response = client.get("/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()[0]["title"] == "Changed elsewhere"
+    assert client.get("/", headers=headers).json()[0]["title"] == "Changed elsewhere"
+    assert client.get(f"/todo/{todo_id}", headers={**headers, "If-None-Match": todo_etag}).status_code == 200
+
+
+def test_delete_from_other_process_changes_etag(client, make_user, create_todo):
+    headers = make_user()
+    create_todo(headers)
+    todo_id = create_todo(headers)
+    etag = client.get("/", headers=headers).headers["ETag"]
+
+    # 删掉的不是 change_seq 最大的那条，版本号也必须变化（墓碑的序号更大）
+    first_todo = min(client.get("/", headers=headers).json(), key=lambda todo: todo["id"])
+    write_from_other_process(first_todo["owner_id"], "DELETE FROM todos WHERE id = :id", id=first_todo["id"])
+
+    response = client.get("/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert [todo["id"] for todo in response.json()] == [todo_id]
@@ -0,0 +1,22 @@
+import asyncio
+
+from events import event_hub
+from routers.todos import todo_events
+
+
+# 客户端在第一块数据之前就断开：响应体的生成器从未启动，不能占住订阅名额
+def test_unstarted_event_stream_does_not_hold_a_slot():
+    async def scenario():
+        user = {"id": 424242, "username": "sse", "user_role": "user"}
+        for _ in range(event_hub.max_subscribers + 1):
+            await todo_events(user)
+        assert event_hub.has_capacity(user["id"])
+        assert event_hub.stats()["subscribers"] == 0
+
+        response = await todo_events(user)
+        assert await response.body_iterator.__anext__() == ": connected\n\n"
+        assert event_hub.stats()["subscribers"] == 1
+        await response.body_iterator.aclose()
+        assert event_hub.stats()["subscribers"] == 0
+
+    asyncio.run(scenario())
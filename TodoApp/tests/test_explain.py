@@ -0,0 +1,9 @@
+import database
+import migrations
+
+
+# 路由实际执行的查询都要走索引（python manage.py explain 做的是同样的检查）
+def test_router_queries_use_indexes(client):
+    report = migrations.explain_router_queries(database.engine)
+    full_scans = {name: plan for name, (uses_index, plan) in report.items() if not uses_index}
+    assert not full_scans
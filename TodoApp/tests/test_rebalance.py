@@ -0,0 +1,41 @@
+from sqlalchemy import select, text
+
+import database
+import migrations
+from models import Todos, TodoTombstones
+
+
+def shard_engine(tmp_path, name: str):
+    engine = database.create_sqlite_engine(f"sqlite:///{tmp_path / name}")
+    migrations.upgrade(engine, shard=True)
+    return engine
+
+
+def add_todo(conn, todo_id: int, owner_id: int):
+    conn.execute(Todos.__table__.insert(), {"id": todo_id, "title": "todo", "description": "todo",
+                                            "priority": 3, "complete": False, "owner_id": owner_id})
+
+
+def tombstones(engine) -> set:
+    with engine.connect() as conn:
+        return set(conn.execute(select(TodoTombstones.owner_id, TodoTombstones.id)).all())
+
+
+# 搬一个用户的数据时，目标分片上别的用户同 id 的墓碑不能被删掉或覆盖
+def test_move_owner_keeps_other_owners_tombstones(tmp_path):
+    source, target = shard_engine(tmp_path, "source.db"), shard_engine(tmp_path, "target.db")
+    with source.begin() as conn:
+        add_todo(conn, 7, owner_id=1)
+        conn.execute(text("DELETE FROM todos WHERE id = 7"))
+        add_todo(conn, 8, owner_id=1)
+    with target.begin() as conn:
+        add_todo(conn, 7, owner_id=2)
+        add_todo(conn, 8, owner_id=2)
+        conn.execute(text("DELETE FROM todos WHERE owner_id = 2"))
+
+    assert migrations._move_owner(source, target, 1) == 1
+
+    assert tombstones(target) == {(2, 7), (2, 8), (1, 7)}
+    assert tombstones(source) == set()
+    with target.connect() as conn:
+        assert conn.execute(select(Todos.id, Todos.owner_id)).all() == [(8, 1)]
@@ -0,0 +1,63 @@
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+import database
+from token_revocation import RevocationStore
+
+
+def revocation_stores(tmp_path, count: int = 2, use_bloom: bool = True, bloom_refresh: float = 3600):
+    engine = database.create_sqlite_engine(f"sqlite:///{tmp_path / 'revocations.db'}")
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # 同一个数据库上的多个 store，相当于多个 worker
+    return [RevocationStore(factory, use_bloom=use_bloom, bloom_refresh=bloom_refresh) for _ in range(count)]
+
+
+# 过滤器刚同步过：没命中就直接放行，不查库；别的 worker 的撤销在下一次同步之后可见
+def test_fresh_bloom_miss_skips_the_database(tmp_path):
+    worker, other = revocation_stores(tmp_path)
+    worker.sync()
+    assert not worker.is_revoked("unknown")
+    assert worker.stats()["bloom_skips"] == 1
+    assert worker.stats()["db_lookups"] == 0
+
+    other.revoke("logged-out", time.time() + 3600)
+    worker.sync()
+    assert worker.stats()["bloom_watermark"] == 1
+    assert worker.is_revoked("logged-out")
+    assert not worker.is_revoked("still-valid")
+    assert worker.stats()["bloom_skips"] == 2
+
+
+# 过滤器超过 bloom_refresh 秒没有同步上：不再信任它的“没命中”，按主键查，别的 worker 的撤销照样生效
+def test_stale_bloom_falls_back_to_the_database(tmp_path):
+    worker, other = revocation_stores(tmp_path, bloom_refresh=0.2)
+    worker.sync()
+    other.revoke("logged-out", time.time() + 3600)
+    time.sleep(0.3)
+    assert worker.is_revoked("logged-out")
+    assert worker.stats()["bloom_skips"] == 0
+    assert worker.stats()["db_lookups"] == 1
+
+
+def test_revocations_survive_a_new_store(tmp_path):
+    worker, = revocation_stores(tmp_path, count=1, use_bloom=False)
+    worker.revoke("logged-out", time.time() + 3600)
+    fresh, = revocation_stores(tmp_path, count=1, use_bloom=False)
+    assert fresh.is_revoked("logged-out")
+    assert not fresh.is_revoked("still-valid")
+
+
+# 清理过期记录后 seq 不能回退，否则新的撤销会落在已经同步过的水位之下
+def test_purge_keeps_sequence_monotonic(tmp_path):
+    worker, other = revocation_stores(tmp_path)
+    other.revoke("expired-1", time.time() - 10)
+    other.revoke("expired-2", time.time() - 10)
+    worker.sync()
+    assert other.purge() == 1
+    assert worker.stats()["bloom_watermark"] == 2
+
+    other.revoke("logged-out", time.time() + 3600)
+    worker.sync()
+    assert worker.stats()["bloom_watermark"] == 3
+    assert worker.is_revoked("logged-out")
@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+
+# 每个用户的 todo 列表（GET / 的完整 JSON 响应体）的进程内缓存。
+# 大部分用户的列表很少变化，但客户端会不停地轮询；命中缓存时不需要查询列表，也不需要重新序列化。
+#
+# 每个条目都记着生成它时这个用户的数据版本（crud.get_owner_version，即 todos 和墓碑里最大的 change_seq），
+# 读的时候先查一次当前版本（走索引，只读一个条目），版本对得上才算命中。
+# 版本由数据库触发器在写事务里推进，所以其它 worker、其它进程（比如 manage.py archive）的写入也会让缓存失效；
+# ETag 用的是同一个版本号（见 routers/todos.py）。
+# 本进程的写操作提交后还会调用 invalidate(owner_id)，只是为了尽早释放过期条目的内存，正确性不依赖它。
+#
+# 版本号在查询之前读取：查询期间如果有写入，条目的版本只会“偏旧”，下次请求时对不上，重新查询。
+
+TODO_LIST_CACHE_SIZE = int(os.getenv("TODO_LIST_CACHE_SIZE", "10000"))                  # 最多缓存多少个用户，0 表示关闭
+TODO_LIST_CACHE_MAX_BYTES = int(os.getenv("TODO_LIST_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class TodoListCache:
+    def __init__(self, maxsize: int = TODO_LIST_CACHE_SIZE, max_bytes: int = TODO_LIST_CACHE_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self._entries: OrderedDict[int, tuple[int, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, owner_id: int, version: int) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(owner_id)
+            if entry is None or entry[0] != version:
+                # 过期的条目直接丢掉
+                self._discard(owner_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(owner_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, owner_id: int, version: int, body: bytes):
+        if not self.enabled or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            entry = self._entries.get(owner_id)
+            # 并发的请求已经放进了更新的版本
+            if entry is not None and entry[0] > version:
+                return
+            self._discard(owner_id)
+            self._entries[owner_id] = (version, body)
+            self.bytes += len(body)
+            while len(self._entries) > self.maxsize or self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, owner_id: int):
+        with self._lock:
+            self._discard(owner_id)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _discard(self, owner_id: int):
+        entry = self._entries.pop(owner_id, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+todo_list_cache = TodoListCache()
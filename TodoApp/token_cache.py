@@ -0,0 +1,71 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 客户端在一个 token 的 20 分钟有效期内，会带着同一个 Bearer token 请求成百上千次。
+# 每次都做 jwt.decode（HMAC 验签 + JSON 解析）是重复劳动：验证过一次的 token，在 exp 之前结果都不会变。
+# 这里用一个有上限的 LRU 缓存保存“已验证的 token -> 解析结果”，命中时只需要一次字典查找。
+
+TOKEN_CACHE_SIZE = int(os.getenv("TODO_TOKEN_CACHE_SIZE", "10000"))
+
+
+class VerifiedTokenCache:
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # key: token 的 sha256 摘要（不在内存里保存完整 token），value: (exp, 解析结果)
+        self._entries: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            exp, value = entry
+            # 过期的 token 必须重新走一遍 jwt.decode，让它抛出 ExpiredSignatureError
+            if exp <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, token: str, value: dict, exp: float | None):
+        # 没有 exp 的 token 不缓存，否则它会一直有效
+        if exp is None or self.maxsize <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (float(exp), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert
+from starlette.concurrency import run_in_threadpool
+
+import database
+import migrations
+from models import RevokedTokens
+
+logger = logging.getLogger(__name__)
+
+# refresh token 的撤销（注销）记录。
+# 以前是进程内的 set，存完整的 token 字符串：只增不减、重启就丢、多个 worker 之间也不共享。
+# 现在按 token 的 jti 记录到 SQLite（revoked_tokens 表），到 token 的 exp 之后就可以删掉：
+# - 热集合：本进程最近撤销的 jti（有上限的 LRU），命中时不查库；
+# - 可选的 Bloom 过滤器（TODO_REVOCATION_BLOOM=1），大小固定，内存不随注销次数增长。
+#   每条撤销记录带一个只增不减的 seq，过滤器记着自己已经包含到哪个 seq（水位），
+#   后台线程每隔 TODO_REVOCATION_BLOOM_REFRESH / 2 秒只读水位之后的新记录补进去（同一时刻最多一个同步在跑）。
+#   过滤器没命中、并且距离上次同步开始不超过 TODO_REVOCATION_BLOOM_REFRESH 秒时，直接判定没撤销，不查库。
+#   代价是有界的延迟：别的 worker 撤销的 token，在本 worker 最多还能用 TODO_REVOCATION_BLOOM_REFRESH 秒
+#   （本进程自己的撤销会同时加进热集合和过滤器，立即生效）。同步落后超过这个时间（比如后台同步失败）就不再信任过滤器；
+# - 其余情况按主键查一次 revoked_tokens。
+# 过期记录每隔 TODO_REVOCATION_PURGE_INTERVAL 秒在后台清理一次（之后整个重建过滤器），
+# 所以不管注销过多少次，表里只剩还没过期的记录。
+
+REVOCATION_HOT_SIZE = int(os.getenv("TODO_REVOCATION_HOT_SIZE", "10000"))
+USE_REVOCATION_BLOOM = os.getenv("TODO_REVOCATION_BLOOM", "0") == "1"
+REVOCATION_BLOOM_BITS = int(os.getenv("TODO_REVOCATION_BLOOM_BITS", str(1 << 20)))   # 128KB
+REVOCATION_BLOOM_HASHES = int(os.getenv("TODO_REVOCATION_BLOOM_HASHES", "7"))
+REVOCATION_BLOOM_REFRESH = float(os.getenv("TODO_REVOCATION_BLOOM_REFRESH", "5"))
+REVOCATION_PURGE_INTERVAL = float(os.getenv("TODO_REVOCATION_PURGE_INTERVAL", "3600"))
+
+
+class BloomFilter:
+    def __init__(self, bits: int = REVOCATION_BLOOM_BITS, hashes: int = REVOCATION_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    # 双重哈希：一次 blake2b 得到两个 64 位值，组合出 k 个位置
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationStore:
+    def __init__(self, session_factory=None, hot_size: int = REVOCATION_HOT_SIZE,
+                 use_bloom: bool = USE_REVOCATION_BLOOM, bloom_refresh: float = REVOCATION_BLOOM_REFRESH):
+        self.session_factory = session_factory or database.SessionLocal
+        self.hot_size = hot_size
+        self.use_bloom = use_bloom
+        self.bloom_refresh = bloom_refresh
+        self.hot_hits = 0
+        self.bloom_skips = 0
+        self.db_lookups = 0
+        self.syncs = 0
+        self._hot: OrderedDict[str, float] = OrderedDict()
+        # 过滤器和它的水位：过滤器一定包含 seq <= 水位的所有（未过期的）撤销记录，以及本进程自己的撤销
+        self._bloom: BloomFilter | None = None
+        self._watermark = 0
+        # 过滤器反映的是这个时刻（最近一次成功同步开始读表的时间）的表；_synced_at 是最近一次尝试同步的时间，只用来安排下一次
+        self._fresh_at = 0.0
+        self._synced_at = 0.0
+        self._syncing = False
+        self._purged_at = time.time()
+        self._lock = threading.Lock()
+        migrations.upgrade_revoked_tokens(self.session_factory.kw["bind"])
+
+    def revoke(self, jti: str, exp: float):
+        # seq 取当前最大值 + 1：写事务在 SQLite 里是串行的，所以 seq 的顺序就是提交顺序
+        next_seq = select(func.coalesce(func.max(RevokedTokens.seq), 0) + 1).scalar_subquery()
+        with self.session_factory() as db:
+            db.execute(
+                insert(RevokedTokens).values(jti=jti, expires_at=int(exp), seq=next_seq)
+                .on_conflict_do_nothing(index_elements=[RevokedTokens.jti])
+            )
+            db.commit()
+        with self._lock:
+            self._hot[jti] = float(exp)
+            self._hot.move_to_end(jti)
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+            if self._bloom is not None:
+                self._bloom.add(jti)
+        self._schedule_sync()
+
+    # 只看内存就能回答时返回 True / False，需要查库时返回 None
+    def _check_memory(self, jti: str, now: float) -> bool | None:
+        with self._lock:
+            exp = self._hot.get(jti)
+            if exp is not None and exp > now:
+                self.hot_hits += 1
+                return True
+            if (self.use_bloom and self._bloom is not None and now - self._fresh_at <= self.bloom_refresh
+                    and jti not in self._bloom):
+                self.bloom_skips += 1
+                return False
+        return None
+
+    def is_revoked(self, jti: str) -> bool:
+        now = time.time()
+        revoked = self._check_memory(jti, now)
+        self._schedule_sync()
+        if revoked is not None:
+            return revoked
+        self.db_lookups += 1
+        with self.session_factory() as db:
+            return db.scalar(
+                select(RevokedTokens.jti).where(RevokedTokens.jti == jti).where(RevokedTokens.expires_at > int(now))
+            ) is not None
+
+    # 到时间了就在后台线程里同步过滤器 / 清理过期记录；已经有同步在跑时什么都不做，请求线程从不等待。
+    # 过滤器每半个 bloom_refresh 同步一次，赶在它过期（不再被信任）之前补上
+    def _schedule_sync(self):
+        now = time.time()
+        with self._lock:
+            if self._syncing:
+                return
+            purge_due = now - self._purged_at > REVOCATION_PURGE_INTERVAL
+            sync_due = self.use_bloom and now - self._synced_at > self.bloom_refresh / 2
+            if not (purge_due or sync_due):
+                return
+            self._syncing = True
+        threading.Thread(target=self._sync_in_background, args=(purge_due,), daemon=True).start()
+
+    def _sync_in_background(self, purge: bool):
+        try:
+            self.sync(purge)
+        except Exception:
+            logger.exception("Syncing revoked tokens failed")
+        finally:
+            with self._lock:
+                self._syncing = False
+                self._synced_at = time.time()
+
+    def sync(self, purge: bool = False):
+        if purge:
+            self.purge()
+        if not self.use_bloom:
+            return
+        # 清理之后过滤器里留着已经删掉的记录（只会多一些误判），整个重建一次；平时只补水位之后的新记录。
+        # 在读表之前记下时间：这个时刻之前提交的撤销一定会被读到
+        started = time.time()
+        if purge or self._bloom is None:
+            self._load_bloom(started)
+        else:
+            self._catch_up(started)
+        self.syncs += 1
+        self._synced_at = time.time()
+
+    def _load_bloom(self, started: float):
+        bloom = BloomFilter()
+        with self.session_factory() as db:
+            # 先读水位再读记录：两次读取之间新增的记录就算也读进来了，水位也只会偏低，不会漏
+            watermark = db.scalar(select(func.max(RevokedTokens.seq))) or 0
+            for jti in db.scalars(select(RevokedTokens.jti).where(RevokedTokens.expires_at > int(time.time()))):
+                bloom.add(jti)
+        with self._lock:
+            for jti in self._hot:
+                bloom.add(jti)
+            self._bloom, self._watermark = bloom, watermark
+            self._fresh_at = started
+
+    def _catch_up(self, started: float):
+        with self._lock:
+            watermark = self._watermark
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(RevokedTokens.jti, RevokedTokens.seq).where(RevokedTokens.seq > watermark)
+            ).all()
+        # 先把记录加进过滤器，再推进水位和新鲜时间（同一把锁下），is_revoked 不会看到“已经算新鲜、记录还没加进去”的状态
+        with self._lock:
+            for jti, _ in rows:
+                self._bloom.add(jti)
+            self._watermark = max([self._watermark, *(seq for _, seq in rows)])
+            self._fresh_at = max(self._fresh_at, started)
+
+    # 删除过期记录，但总是留下 seq 最大的那一条：表里最大的 seq 只增不减，新的撤销记录的 seq 才不会和已经同步过的水位重复
+    def purge(self) -> int:
+        now = time.time()
+        latest_seq = select(func.coalesce(func.max(RevokedTokens.seq), 0)).scalar_subquery()
+        with self.session_factory() as db:
+            purged = db.execute(
+                delete(RevokedTokens).where(RevokedTokens.expires_at <= int(now))
+                .where(func.coalesce(RevokedTokens.seq, 0) < latest_seq)
+            ).rowcount
+            db.commit()
+        with self._lock:
+            for jti in [jti for jti, exp in self._hot.items() if exp <= now]:
+                del self._hot[jti]
+            self._purged_at = now
+        return purged
+
+    async def revoke_async(self, jti: str, exp: float):
+        await run_in_threadpool(self.revoke, jti, exp)
+
+    async def is_revoked_async(self, jti: str) -> bool:
+        # 热集合命中、或者可以信任过滤器的“没命中”时不用进线程池
+        revoked = self._check_memory(jti, time.time())
+        if revoked is None:
+            return await run_in_threadpool(self.is_revoked, jti)
+        self._schedule_sync()
+        return revoked
+
+    def stats(self) -> dict:
+        return {
+            "hot_size": len(self._hot),
+            "hot_hits": self.hot_hits,
+            "bloom": self.use_bloom,
+            "bloom_watermark": self._watermark,
+            "bloom_skips": self.bloom_skips,
+            "db_lookups": self.db_lookups,
+            "syncs": self.syncs,
+        }
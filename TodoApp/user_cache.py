@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# get_current_user 以前只看 JWT 里的声明：用户被停用、角色被修改之后，手里的 token 在过期前（20 分钟）照样能用。
+# 每个请求都去 users 表查一次又太贵，所以把“按 id 查到的用户状态”缓存 USER_CACHE_TTL 秒：
+# - 本进程内修改用户（crud.update_user / create_user）时立即失效；
+# - 其它 worker 改的最多 USER_CACHE_TTL 秒后生效。
+# 查不到的用户也会缓存（当作未激活），被删掉的用户的 token 不会每次都打到数据库。
+
+USER_CACHE_TTL = float(os.getenv("TODO_USER_CACHE_TTL", "30"))
+USER_CACHE_SIZE = int(os.getenv("TODO_USER_CACHE_SIZE", "10000"))
+
+
+class ActiveUserCache:
+    def __init__(self, ttl: float = USER_CACHE_TTL, maxsize: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # key: 用户 id，value: (过期时间, {"id", "username", "role", "is_active"})
+        self._entries: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, user_id: int) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: int, user: dict):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self.invalidations += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+active_user_cache = ActiveUserCache()
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+
+import database
+
+logger = logging.getLogger(__name__)
+
+# 分组提交（group commit）：每次 db.commit() 都是一次 fsync，写吞吐被“每秒能做多少次 fsync”卡死。
+# 打开 TODO_WRITE_BATCHING=1 后，todo 的写操作不再各自提交，而是放进一个 asyncio 队列，
+# 由唯一的 writer 任务攒够 WRITE_BATCH_SIZE 个、或者等满 WRITE_BATCH_DELAY_MS 毫秒，在同一个事务里执行并只提交一次。
+# 每个调用方仍然拿到自己那一个操作的返回值或异常。
+#
+# 如果组里某个操作抛了异常，整个事务回滚，然后把这一组逐个单独重新执行（各自提交），
+# 这样一个坏请求不会连累同组的其它请求。
+#
+# 分片模式下（database.TODO_SHARDS）每个操作都带着它所在分片的 engine，一组操作按 engine 拆开，每个分片各自一个事务。
+
+USE_WRITE_BATCHING = os.getenv("TODO_WRITE_BATCHING", "0") == "1"
+WRITE_BATCH_SIZE = int(os.getenv("TODO_WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_DELAY_MS = float(os.getenv("TODO_WRITE_BATCH_DELAY_MS", "5"))
+WRITE_QUEUE_SIZE = int(os.getenv("TODO_WRITE_QUEUE_SIZE", "10000"))
+
+
+class GroupCommitWriter:
+    def __init__(self, session_factory=None, batch_size: int = WRITE_BATCH_SIZE,
+                 batch_delay_ms: float = WRITE_BATCH_DELAY_MS, queue_size: int = WRITE_QUEUE_SIZE):
+        # 传了 session_factory 时所有操作都用它；否则按操作所在的 engine 各建一个
+        self.session_factory = session_factory
+        self._factories = {}
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay_ms / 1000
+        self.queue_size = queue_size
+        self.batches = 0
+        self.operations = 0
+        self.fallbacks = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # 先把队列里已经收下的操作处理完
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    # fn 是 crud.py 里的同步写函数，签名为 fn(db, *args)；bind 是它要写入的 engine，默认是 todos.db
+    async def submit(self, fn, *args, bind=None):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, args, future, bind or database.engine))
+        return await future
+
+    def _session_factory(self, bind):
+        if self.session_factory is not None:
+            return self.session_factory
+        if bind not in self._factories:
+            # expire_on_commit=False：提交后返回给调用方的对象仍然可以读取属性
+            self._factories[bind] = sessionmaker(bind=bind, autoflush=False, expire_on_commit=False)
+        return self._factories[bind]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[3], []).append(item)
+            for bind, group in groups.items():
+                try:
+                    outcomes = await run_in_threadpool(
+                        self._execute_batch, [(fn, args) for fn, args, _, _ in group], bind
+                    )
+                except Exception as exc:
+                    # 整组提交失败（例如磁盘错误），每个调用方都收到这个异常
+                    outcomes = [(False, exc)] * len(group)
+                for (_, _, future, _), (ok, value) in zip(group, outcomes):
+                    if not future.done():
+                        if ok:
+                            future.set_result(value)
+                        else:
+                            future.set_exception(value)
+                    self._queue.task_done()
+
+    # 在线程池里执行：整组一个事务
+    def _execute_batch(self, operations: list, bind=None) -> list:
+        with self._session_factory(bind)() as db:
+            db.info["deferred_events"] = []
+
+            def run_group():
+                db.info["deferred_events"].clear()
+                results = [(True, fn(db, *args)) for fn, args in operations]
+                db.commit()
+                return results
+
+            try:
+                # 其它进程持有写锁时，整组回滚后按退避策略重试
+                results = database.busy_retry.run(run_group, rollback=db.rollback)
+            except Exception:
+                db.rollback()
+                logger.warning("Group commit failed, retrying %d operations one by one", len(operations))
+                self.fallbacks += 1
+                return [self._execute_single(fn, args, bind) for fn, args in operations]
+            deferred_events = db.info.pop("deferred_events")
+        self.batches += 1
+        self.operations += len(operations)
+        for notify in deferred_events:
+            notify()
+        return results
+
+    def _execute_single(self, fn, args, bind=None) -> tuple:
+        with self._session_factory(bind)() as db:
+            try:
+                return True, database.busy_retry.run(fn, db, *args, rollback=db.rollback)
+            except Exception as exc:
+                db.rollback()
+                return False, exc
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "operations": self.operations,
+            "avg_batch_size": self.operations / self.batches if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+        }
+
+
+group_writer = GroupCommitWriter()
@@ -1,11 +1,14 @@
+import uuid
 from datetime import datetime, timedelta, timezone
 from typing import Annotated, Dict
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 from database import SessionLocal
+import hashing
+from token_cache import VerifiedTokenCache
+from token_revocation import RevocationStore
 from models import Users
 import jwt
 from jwt.exceptions import InvalidTokenError
@@ -21,10 +24,10 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 20
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+bcrypt_context = hashing.bcrypt_context   # ✅ hash/verify 在有界的线程/进程池中执行，见 hashing.py
 
-# ✅ 黑名单（简单用内存存储，可以换成 Redis）
-TOKEN_BLACKLIST = set()
+# ✅ 撤销记录按 jti 存在 SQLite 里，过了 token 的 exp 自动清理；前面有进程内热集合和可选的 Bloom 过滤器，见 token_revocation.py
+revocation_store = RevocationStore()
 
 # ==========================
 # Pydantic 模型
@@ -64,12 +67,12 @@ db_dependency = Annotated[Session, Depends(get_db)]
 # ==========================
 # 密码处理
 # ==========================
-def get_password_hash(password: str) -> str:
-    return bcrypt_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await hashing.hash_password(password)
 
-def authenticate_user(username: str, password: str, db) -> Users | bool:
+async def authenticate_user(username: str, password: str, db) -> Users | bool:
     user = db.query(Users).filter(Users.username == username).first()
-    if not user or not bcrypt_context.verify(password, user.hashed_password):
+    if not user or not await hashing.verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -78,14 +81,23 @@ def authenticate_user(username: str, password: str, db) -> Users | bool:
 # ==========================
 def create_token(data: Dict, expires_delta: timedelta) -> str:
     payload = data.copy()
-    payload.update({"exp": datetime.now(timezone.utc) + expires_delta})
+    # jti：token 的唯一编号，撤销时只需要记录它
+    payload.update({"exp": datetime.now(timezone.utc) + expires_delta, "jti": uuid.uuid4().hex})
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
+# ✅ 已验证的 token 缓存到 exp 为止，避免每个请求都重新验签
+token_cache = VerifiedTokenCache()
+
 def decode_token(token: str) -> Dict:
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
-        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except InvalidTokenError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token.")
+    token_cache.put(token, payload, payload.get("exp"))
+    return payload
 
 # ==========================
 # 获取当前用户
@@ -113,7 +125,7 @@ async def create_user(db: db_dependency, create_user_request: CreateUserRequest)
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Username or Email already exists.")
     
     user_data = create_user_request.model_dump(exclude={"password"})
-    create_user_model = Users(**user_data, hashed_password=get_password_hash(create_user_request.password))
+    create_user_model = Users(**user_data, hashed_password=await get_password_hash(create_user_request.password))
     
     db.add(create_user_model)
     db.commit()
@@ -123,7 +135,7 @@ async def create_user(db: db_dependency, create_user_request: CreateUserRequest)
 # 2. 登录，返回 Access 和 Refresh Token
 @router.post("/token", response_model=TokenResponse)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency):
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid username or password.")
     
@@ -141,12 +153,12 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
 # 3. 刷新 Access Token
 @router.post("/refresh")
 async def refresh_access_token(request: RefreshRequest):
-    if request.refresh_token in TOKEN_BLACKLIST:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token revoked.")
-    
     payload = decode_token(request.refresh_token)
-    if payload.get("type") != "refresh":
+    # 没有 jti 的旧 token 没法撤销，直接要求重新登录
+    if payload.get("type") != "refresh" or not payload.get("jti"):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token.")
+    if await revocation_store.is_revoked_async(payload["jti"]):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token revoked.")
     
     new_access_token = create_token(
         {"sub": payload["sub"], "id": payload["id"], "role": payload["role"]},
@@ -158,5 +170,8 @@ async def refresh_access_token(request: RefreshRequest):
 # 4. 注销（撤销 Refresh Token）
 @router.post("/logout")
 async def logout(request: LogoutRequest):
-    TOKEN_BLACKLIST.add(request.refresh_token)
+    payload = decode_token(request.refresh_token)
+    if payload.get("type") != "refresh" or not payload.get("jti"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token.")
+    await revocation_store.revoke_async(payload["jti"], payload["exp"])
     return {"message": "Logged out successfully."}
\ No newline at end of file